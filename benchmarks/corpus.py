@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Generator of synthetic LaTeX projects for the benchmarks.
+
+    python3 benchmarks/corpus.py OUT_DIR --sections 500 --labels 2000
+
+A project has a main file including a tree of chapter/section files, with
+sections, labels in nested theorem/equation environments, blocks of the
+comment package, and the matching .out file and .aux files (one for each
+\include'd chapter, \@input'ed by main.aux, as written by LaTeX).
+"""
+
+import os
+import sys
+import random
+import argparse
+
+# Environments in which the labels are put (nested ones are separated by '/')
+label_envs = ["theorem", "lemma", "equation", "theorem/equation",
+              "proof/align", "definition", "figure", "lemma/itemize/equation"]
+sectioning = ["section", "subsection", "subsubsection"]
+words = ["Algebra", "Analysis", "Bounds", "Convergence", "Dimension", "Entropy",
+         "Fields", "Groups", "Homology", "Integrals", "Kernels", "Limits",
+         "Measures", "Norms", "Operators", "Proofs", "Rings", "Spectra"]
+
+
+class Corpus:
+    '''Text of the files of a project, built in document order'''
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.numbers = {"chapter": 0, "section": 0, "subsection": 0,
+                        "subsubsection": 0, "equation": 0, "theorem": 0}
+        self.aux = []
+        self.out = []
+        self.label_count = 0
+
+    def title(self):
+        return " ".join(self.rng.sample(words, 3))
+
+    def number(self, kind):
+        '''Number of a new sectioning command, the finer counters being reset'''
+        order = ["chapter"] + sectioning
+        self.numbers[kind] += 1
+        for finer in order[order.index(kind) + 1:]:
+            self.numbers[finer] = 0
+        return ".".join(str(self.numbers[k]) for k in order[:order.index(kind) + 1])
+
+    def sectioning_command(self, kind):
+        title = self.title()
+        number = self.number(kind)
+        self.aux.append("\\@writefile{toc}{\\contentsline {%s}"
+                        "{\\numberline {%s}%s}{1}{%s.%s}{}}"
+                        % (kind, number, title, kind, number))
+        self.out.append("\\BOOKMARK [%d][-]{%s.%s}{%s}{}%% %d"
+                        % (sectioning.index(kind) + 1 if kind in sectioning else 0,
+                           kind, number, bookmark(number + " " + title),
+                           len(self.out) + 1))
+        return "\\%s{%s}\n" % (kind, title)
+
+    def labelled_environment(self):
+        self.label_count += 1
+        name = "lbl:%d" % self.label_count
+        envs = self.rng.choice(label_envs).split("/")
+        if envs[-1] in ("equation", "align"):
+            self.numbers["equation"] += 1
+            ref = "%d.%d" % (self.numbers["chapter"], self.numbers["equation"])
+        else:
+            self.numbers["theorem"] += 1
+            ref = "%d.%d" % (self.numbers["chapter"], self.numbers["theorem"])
+        self.aux.append("\\newlabel{%s}{{%s}{1}{%s}{%s.%s}{}}"
+                        % (name, ref, self.title(), envs[-1], ref))
+        lines = ["\\begin{%s}" % env for env in envs]
+        lines.append("x = y \\label{%s}" % name)
+        lines.extend("\\end{%s}" % env for env in reversed(envs))
+        return "\n".join(lines) + "\n"
+
+    def commented_block(self):
+        return ("\\begin{comment}\n\\section{Commented out}\n"
+                "\\label{commented:%d}\n\\end{comment}\n" % self.label_count)
+
+# ------------------------------
+
+
+def bookmark(title):
+    '''Title as written by hyperref in the .out file (UTF-16, octal escapes)'''
+    data = "\ufeff".encode("utf-16-be") + title.encode("utf-16-be")
+    return "".join("\\%03o" % b for b in data)
+
+
+def generate_project(out_dir, sections=100, labels=400, chapters=5, depth=2,
+                     comment_blocks=5, seed=0):
+    '''
+    Writes a project in out_dir and returns the path of its root file.
+    The sections are spread over `chapters` chapter files, each including a
+    tree of `depth` levels of section files.
+    '''
+    rng = random.Random(seed)
+    corpus = Corpus(rng)
+    os.makedirs(os.path.join(out_dir, "chapters"), exist_ok=True)
+
+    leaves = chapters * (2 ** max(depth - 1, 0))
+    per_leaf = max(sections // leaves, 1)
+    labels_per_section = max(labels // max(sections, 1), 0)
+    comments_left = comment_blocks
+
+    def leaf_body():
+        nonlocal comments_left
+        text = []
+        for i in range(per_leaf):
+            kind = sectioning[0] if i == 0 else rng.choice(sectioning)
+            text.append(corpus.sectioning_command(kind))
+            text.append("Some text about %s.\n" % corpus.title())
+            for _ in range(labels_per_section):
+                text.append(corpus.labelled_environment())
+            if comments_left > 0 and rng.random() < 0.2:
+                comments_left -= 1
+                text.append(corpus.commented_block())
+        return "".join(text)
+
+    main = ["\\documentclass{book}", "\\usepackage{comment}",
+            "\\usepackage{amsthm}", "\\newtheorem{theorem}{Theorem}",
+            "\\title{A synthetic book}", "\\begin{document}"]
+    for c in range(chapters):
+        main.append("\\include{chapters/ch%d}" % c)
+    main.append("\\end{document}")
+
+    # Files are generated in document order, so that the numbers are right
+    main_aux = ["\\relax"]
+    for c in range(chapters):
+        name = "ch%d" % c
+        corpus.aux = []
+        main_aux.append("\\@input{chapters/%s.aux}" % name)
+        chapter = corpus.sectioning_command("chapter")
+        if depth <= 1:
+            body = chapter + leaf_body()
+        else:
+            body = chapter + "".join("\\input{chapters/%s_%d}\n" % (name, k)
+                                     for k in range(2))
+            _write_children(out_dir, name, 1, depth, leaf_body)
+        with open(os.path.join(out_dir, "chapters", name + ".tex"), "w",
+                  encoding="utf-8") as f:
+            f.write(body)
+        _write_aux(os.path.join(out_dir, "chapters", name + ".aux"),
+                   ["\\relax"] + corpus.aux)
+
+    root = os.path.join(out_dir, "main.tex")
+    with open(root, "w", encoding="utf-8") as f:
+        f.write("\n".join(main) + "\n")
+    _write_aux(os.path.join(out_dir, "main.aux"), main_aux)
+    with open(os.path.join(out_dir, "main.out"), "w", encoding="utf-8") as f:
+        f.write("\n".join(corpus.out) + "\n")
+    return root
+
+
+def _write_children(out_dir, name, level, depth, leaf_body):
+    '''Writes the two files included by chapters/name.tex, depth first'''
+    for k in range(2):
+        child = "%s_%d" % (name, k)
+        if level >= depth - 1:
+            body = leaf_body()
+        else:
+            body = "".join("\\input{chapters/%s_%d}\n" % (child, j) for j in range(2))
+            _write_children(out_dir, child, level + 1, depth, leaf_body)
+        with open(os.path.join(out_dir, "chapters", child + ".tex"), "w",
+                  encoding="utf-8") as f:
+            f.write(body)
+
+
+def _write_aux(filename, lines):
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+# ------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates a synthetic LaTeX project.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--sections", type=int, default=100)
+    parser.add_argument("--labels", type=int, default=400)
+    parser.add_argument("--chapters", type=int, default=5)
+    parser.add_argument("--depth", type=int, default=2,
+                        help="depth of the include tree below each chapter")
+    parser.add_argument("--comment-blocks", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    root = generate_project(args.out_dir, args.sections, args.labels, args.chapters,
+                            args.depth, args.comment_blocks, args.seed)
+    print(root)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
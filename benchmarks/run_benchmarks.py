@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the outline engine on synthetic projects (see corpus.py).
+
+    python3 benchmarks/run_benchmarks.py --sizes 100,500,2000
+
+Each stage of a refresh is timed separately, for each project size.
+The results are appended to benchmarks/results.jsonl and compared with the
+previous run on the same sizes, to spot regressions.
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import argparse
+import tempfile
+import importlib
+import subprocess
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, os.path.dirname(package_dir))
+sys.path.insert(0, bench_dir)
+
+package = os.path.basename(package_dir)
+lo_engine = importlib.import_module(package + ".lo_engine")
+parse_aux = importlib.import_module(package + ".parse_aux")
+parse_out = importlib.import_module(package + ".parse_out")
+detect_environment = importlib.import_module(package + ".detect_environment")
+text_index = importlib.import_module(package + ".text_index")
+file_contents = importlib.import_module(package + ".file_contents")
+include_graph = importlib.import_module(package + ".include_graph")
+from corpus import generate_project
+
+default_results = os.path.join(bench_dir, "results.jsonl")
+# Slowdown (relative) above which a stage is reported as a regression
+regression_threshold = 0.2
+
+
+def reset_caches():
+    '''Forgets the in-memory caches, so that each run starts cold'''
+    file_contents.file_contents.disk.clear()
+    include_graph.include_graph.nodes.clear()
+    include_graph.include_graph.graphs.clear()
+    text_index.get_text_index.cache_clear()
+    parse_aux.aux_cache.files.clear()
+    parse_aux.merged_trees.clear()
+    lo_engine.new_lo_line.cache_clear()
+
+
+def best_time(func, setup=None, repeat=5):
+    '''Best duration (ms) of func(*setup()) over some runs, caches reset each time'''
+    best = math.inf
+    for _ in range(repeat):
+        reset_caches()
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+# ------------------------------
+
+
+def bench_project(root, repeat):
+    '''Durations (ms) of the stages of a refresh on the project of root'''
+    root_base = os.path.splitext(root)[0]
+    base_symlist, tex_files = lo_engine.get_symbols(root)
+    contents = {f: lo_engine.get_contents_from_latex_file(f) for f in tex_files}
+
+    def symlist():
+        return lo_engine.build_symlist(base_symlist, root, True, True)
+
+    def env_pairs():
+        for text in contents.values():
+            detect_environment.find_env_pairs(text or "")
+
+    results = {
+        "get_symbols": best_time(lambda: lo_engine.get_symbols(root), repeat=repeat),
+        "fill_symlist": best_time(symlist, repeat=repeat),
+        "parse_aux_file": best_time(
+            lambda: parse_aux.parse_aux_file(root_base + ".aux"), repeat=repeat),
+        "load_aux_tree": best_time(
+            lambda: parse_aux.load_aux_tree(root_base + ".aux"), repeat=repeat),
+        "parse_out_file": best_time(
+            lambda: parse_out.parse_out_file(root_base + ".out"), repeat=repeat),
+        "find_env_pairs": best_time(env_pairs, repeat=repeat),
+        "env_names": best_time(
+            lambda sl: lo_engine.add_env_names(sl, tex_files, root, True),
+            setup=lambda: (symlist(),), repeat=repeat),
+    }
+    counts = {"files": len(tex_files),
+              "symbols": len(base_symlist),
+              "bytes": sum(len(text or "") for text in contents.values())}
+    return results, counts
+
+
+def scaling(sizes, timings):
+    '''Log-log slope of the durations of a stage between the extreme sizes'''
+    if len(sizes) < 2 or timings[0] <= 0 or timings[-1] <= 0:
+        return None
+    return math.log(timings[-1] / timings[0]) / math.log(sizes[-1] / sizes[0])
+
+# ------------------------------
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=package_dir,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(results_file, sizes):
+    '''Last stored run with the same sizes, if any'''
+    previous = None
+    if os.path.exists(results_file):
+        with open(results_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    continue
+                if run.get("sizes") == sizes:
+                    previous = run
+    return previous
+
+
+def report(run, previous):
+    sizes = run["sizes"]
+    stages = list(run["stages"])
+    print("%-16s" % "stage" + "".join("%12s" % ("n=%d" % n) for n in sizes) + "   slope")
+    for stage in stages:
+        timings = run["stages"][stage]
+        slope = scaling(sizes, timings)
+        print("%-16s" % stage + "".join("%10.2fms" % t for t in timings)
+              + ("   %.2f" % slope if slope is not None else ""))
+
+    if previous is None:
+        return []
+    regressions = []
+    for stage in stages:
+        old = previous["stages"].get(stage)
+        if not old:
+            continue
+        for n, new_t, old_t in zip(sizes, run["stages"][stage], old):
+            if old_t > 0 and (new_t - old_t) / old_t > regression_threshold:
+                regressions.append((stage, n, old_t, new_t))
+    print("\nCompared with %s (%s):" % (previous.get("revision"), previous.get("date")))
+    if not regressions:
+        print("  no regression")
+    for stage, n, old_t, new_t in regressions:
+        print("  %s (n=%d): %.2fms -> %.2fms (+%d%%)"
+              % (stage, n, old_t, new_t, 100 * (new_t - old_t) / old_t))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the outline engine.")
+    parser.add_argument("--sizes", default="100,500,2000",
+                        help="numbers of sections of the generated projects")
+    parser.add_argument("--labels-per-section", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--results", default=default_results,
+                        help="file where the results are stored (JSON lines)")
+    parser.add_argument("--no-store", action="store_true",
+                        help="do not store the results")
+    args = parser.parse_args(argv)
+
+    sizes = [int(n) for n in args.sizes.split(",")]
+    stages = {}
+    counts = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            root = generate_project(os.path.join(tmp, "n%d" % n), sections=n,
+                                    labels=n * args.labels_per_section,
+                                    chapters=max(n // 100, 2), depth=args.depth,
+                                    comment_blocks=max(n // 50, 1))
+            results, project_counts = bench_project(root, args.repeat)
+            counts.append(project_counts)
+            for stage, duration in results.items():
+                stages.setdefault(stage, []).append(duration)
+
+    run = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+           "revision": git_revision(),
+           "python": sys.version.split()[0],
+           "sizes": sizes,
+           "counts": counts,
+           "stages": stages}
+    previous = previous_run(args.results, sizes)
+    regressions = report(run, previous)
+    if not args.no_store:
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(run) + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,127 +4,96 @@
 # https://github.com/SublimeText/LaTeXTools
 
 import re
+import heapq
+from .text_index import comment_or_escape_pattern
 
 # ------------- Some regex patterns ----------------
 
 begin_pattern = r"\\begin\{([^\}]*)\}"
-end_pattern = r"\\end\{([^\}]*)\}"
 begin_re = re.compile(begin_pattern)
-end_re = re.compile(end_pattern)
-comment_line_re = re.compile(r"\s*%.*")
+env_token_re = re.compile(comment_or_escape_pattern + r"|\\(begin|end)\{([^\}]*)\}")
 
-# -------------------------------------------------
-
-def find_env_regions(contents, pos, pairs):
-    """returns the regions corresponding to nearest matching environments"""
-
-    def extract_begin_region(region):
-        s = contents[region[0]:region[1]]
-        boffset = len("\\begin{")
-        m = begin_re.search(s)
-        if m:
-            boffset = m.regs[1][0]
-        return [region[0] + boffset, region[1] - 1]
+# Environments whose body is not LaTeX: no \begin/\end is looked for inside
+verbatim_envs = {"verbatim", "verbatim*", "Verbatim", "Verbatim*", "lstlisting",
+                 "minted", "comment"}
 
-    def extract_end_region(region):
-        boffset = len("\\end{")
-        return [region[0] + boffset, region[1] - 1]
-
-    new_regions = []
-    try:
-        begin, end = _find_surrounding_pair(contents, pairs, pos)
-    except:
-        return []
-    begin_region = extract_begin_region(begin)
-    end_region = extract_end_region(end)
-    new_regions.append(begin_region)
-    new_regions.append(end_region)
-    new_regions.append([begin[0], end[1]])
+# -------------------------------------------------
 
-    return new_regions
+def find_innermost_envs(pairs, positions):
+    """
+    For each position, the innermost (begin, end) pair surrounding it (or None),
+    found in one sweep over the pairs and the positions sorted by offset
+    """
+    pairs = sorted(pairs, key=lambda pair: pair[0][0])
+    order = sorted(range(len(positions)), key=positions.__getitem__)
+    result = [None] * len(positions)
+    # Opened pairs, the innermost (last opened) first
+    opened = []
+    k = 0
+    for i in order:
+        pos = positions[i]
+        while k < len(pairs) and pairs[k][0][0] <= pos:
+            heapq.heappush(opened, (-pairs[k][0][0], k))
+            k += 1
+        # Pairs closed before pos do not surround any later position either
+        while opened and pairs[opened[0][1]][1][1] < pos:
+            heapq.heappop(opened)
+        if opened:
+            result[i] = pairs[opened[0][1]]
+    return result
 
 # ------------------------------
 
-
-def get_lines(text, start, end):
-    line_start = text.rfind('\n', 0, start)
-    line_start = 0 if line_start == -1 else line_start + 1
-    line_end = text.find('\n', end)
-    line_end = len(text) if line_end == -1 else line_end
-    return text[line_start:line_end]
+def env_name(contents, begin):
+    """Name of the environment opened by the \\begin{...} region begin"""
+    m = begin_re.match(contents, begin[0])
+    return m.group(1) if m else ""
 
 # ------------------------------
 
-def is_comment(contents, reg):
-    line_str = get_lines(contents, reg[0], reg[1])
-    return comment_line_re.match(line_str) is not None
-
-# ------------------------------
 
-def filter_non_comment_regions(contents, regions):
-    
-    return [r for r in regions if not is_comment(contents, r)]
+def env_events(contents):
+    """
+    Yields the ("begin"|"end", region, name) events of the environments of
+    contents, in a single pass: commented ones and those inside the body of
+    a verbatim-like environment are skipped
+    """
+    pos = 0
+    while True:
+        m = env_token_re.search(contents, pos)
+        if m is None:
+            return
+        pos = m.end()
+        kind, name = m.group(1), m.group(2)
+        if kind is None:
+            # Escaped character or comment
+            continue
+        yield (kind, (m.start(), m.end()), name)
+        if kind == "begin" and name in verbatim_envs:
+            end_tag = "\\end{" + name + "}"
+            end = contents.find(end_tag, pos)
+            if end == -1:
+                return
+            pos = end + len(end_tag)
+            yield ("end", (end, pos), name)
 
 # ------------------------------
 
-def _extract_env_name(contents, region, is_begin):
-    s = contents[region[0]:region[1]]
-    if is_begin:
-        m = begin_re.search(s)
-    else:
-        m = end_re.search(s)
-    if m:
-        return m.group(1)
-    return ""
+def find_env_pairs(contents):
+    """Matching (begin, end) regions of the environments of contents"""
+    return _pair_events(env_events(contents))
 
 # ------------------------------
 
-def _find_surrounding_pair(contents, pairs, pos):
-    matching_pairs = []
-    for begin, end in pairs:
-        if begin[0] <= pos <= end[1]:
-            name_begin = _extract_env_name(contents, begin, is_begin=True)
-            name_end = _extract_env_name(contents, end, is_begin=False)
-            if name_begin == name_end:
-                matching_pairs.append((begin, end, begin[0]))
-    if not matching_pairs:
-        return []
-
-    matching_pairs.sort(key=lambda x: -x[2])
-    return (matching_pairs[0][0], matching_pairs[0][1])
-
-# ------------------------------
-
-def match_envs(contents, begins, ends):
-
-    events = []
-    for b in begins:
-        text = contents[b[0]:b[1]]
-        m = begin_re.search(text)
-        if m:
-            name = m.group(1)
-            events.append(("begin", b, name))
-    for e in ends:
-        text = contents[e[0]:e[1]]
-        m = end_re.search(text)
-        if m:
-            name = m.group(1)
-            events.append(("end", e, name))
-
-    events.sort(key=lambda x: x[1][0])
-
-    stack = []
+def _pair_events(events):
+    # The unmatched begins, by name: an end closes the last one of its name
+    stacks = {}
     pairs = []
-
     for kind, reg, name in events:
         if kind == "begin":
-            stack.append((reg, name))
-        elif kind == "end":
-            for i in reversed(range(len(stack))):
-                b_reg, b_name = stack[i]
-                if b_name == name:
-                    pairs.append((b_reg, reg))
-                    del stack[i]
-                    break
-
+            stacks.setdefault(name, []).append(reg)
+        else:
+            stack = stacks.get(name)
+            if stack:
+                pairs.append((stack.pop(), reg))
     return pairs
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from collections import OrderedDict
+
+# Number of files whose contents are kept in memory
+max_files = 512
+
+
+class FileContents:
+    '''
+    Contents of the LaTeX files, shared by all the readers.
+    The text of a modified buffer is served when the file is open (see
+    set_buffer_source), otherwise the file is read from disk and kept until
+    its mtime or size changes.
+    '''
+
+    def __init__(self):
+        self.disk = OrderedDict()
+        self.lock = threading.Lock()
+        self.buffer_source = None
+
+    def set_buffer_source(self, buffer_source):
+        '''
+        buffer_source(path) returns the text of the unsaved buffer of path,
+        or None if the file is not open or has no unsaved changes
+        '''
+        self.buffer_source = buffer_source
+
+    def buffer_text(self, path):
+        '''Text of the unsaved buffer of path, if any'''
+        if self.buffer_source is None or not path:
+            return None
+        return self.buffer_source(path)
+
+    def get_text(self, path):
+        '''Current text of the file (None if it cannot be read)'''
+        text = self.buffer_text(path)
+        if text is not None:
+            return text
+        return self.disk_text(path)
+
+    def version(self, path):
+        '''
+        A value which changes when the text of the file changes,
+        without reading the file (None if it does not exist)
+        '''
+        text = self.buffer_text(path)
+        if text is not None:
+            return ("buffer", len(text), hash(text))
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def disk_text(self, path):
+        '''Text of the file on disk, read again only if it changed'''
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        with self.lock:
+            cached = self.disk.get(path)
+            if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                self.disk.move_to_end(path)
+                return cached[2]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+        with self.lock:
+            self.disk[path] = (st.st_mtime_ns, st.st_size, text)
+            self.disk.move_to_end(path)
+            while len(self.disk) > max_files:
+                self.disk.popitem(last=False)
+        return text
+
+# ------------------------------
+
+
+file_contents = FileContents()
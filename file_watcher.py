@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+
+# Seconds between two checks of the watched files
+poll_interval = 0.5
+# Seconds without any new change after which a burst of changes is reported
+settle_delay = 0.8
+
+
+class ProjectWatcher(threading.Thread):
+    '''
+    Watches the files of a project (their mtime and size) whatever modifies
+    them: a build in Sublime Text, latexmk -pvc in a terminal, a checkout...
+    The changes are coalesced: on_change(root, changed paths) is called once,
+    when no file has changed during settle_delay.
+    '''
+
+    def __init__(self, root, paths, on_change):
+        super().__init__(name="LaTeXOutline watcher", daemon=True)
+        self.root = root
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.stopped = threading.Event()
+        self.states = None
+        self.pending = set()
+        self.last_change = 0
+
+    def set_paths(self, paths):
+        # Replaced at once, the thread reads it without lock
+        self.paths = list(paths)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        self.states = self.snapshot()
+        while not self.stopped.wait(poll_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print("LaTeXOutline: error while watching {}\n{}".format(self.root, e))
+
+    def snapshot(self):
+        states = {}
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                states[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                states[path] = None
+        return states
+
+    def check(self):
+        states = self.snapshot()
+        # Newly watched files are not changes
+        changed = {path for path, state in states.items()
+                   if path in self.states and self.states[path] != state}
+        self.states = states
+        now = time.monotonic()
+        if changed:
+            self.pending |= changed
+            self.last_change = now
+        elif self.pending and now - self.last_change >= settle_delay:
+            pending, self.pending = self.pending, set()
+            self.on_change(self.root, pending)
+
+# ------------------------------
+
+
+watchers = {}
+watchers_lock = threading.Lock()
+
+
+def watch(root, paths, on_change):
+    '''Watches the files of the project of root (one shared thread per root)'''
+    with watchers_lock:
+        watcher = watchers.get(root)
+        if watcher is not None and watcher.is_alive():
+            watcher.set_paths(paths)
+            watcher.on_change = on_change
+            return watcher
+        watcher = ProjectWatcher(root, paths, on_change)
+        watchers[root] = watcher
+    watcher.start()
+    return watcher
+
+
+def retain(roots):
+    '''Stops watching the projects whose root is not in roots'''
+    with watchers_lock:
+        for root in [r for r in watchers if r not in roots]:
+            watchers.pop(root).stop()
+
+
+def unwatch_all():
+    retain(())
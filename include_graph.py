@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .file_contents import file_contents
+from .text_index import get_text_index, comment_or_escape_pattern
+from .symbol_cache import get_symbol_cache
+
+# ------------- Some regex patterns ----------------
+
+include_re = re.compile(
+    comment_or_escape_pattern
+    + r"|\\(?P<cmd>input|include|subfile)\s*\{(?P<file>[^}]*)\}"
+    r"|\\(?P<imp>import|subimport)\s*\{(?P<dir>[^}]*)\}\s*\{(?P<ifile>[^}]*)\}"
+    r"|\\includeonly\s*\{(?P<only>[^}]*)\}")
+
+# -------------------------------------------------
+
+
+class IncludeGraph:
+    '''
+    Tree of the files included in a root LaTeX file, through
+    \\input, \\include (restricted by \\includeonly), \\subfile, \\import
+    and \\subimport. The files of a level of the tree are read in parallel.
+    The includes of each file are kept until the file changes (also in the
+    symbol cache, so that a file is not read again at the next start),
+    and the whole tree is kept for each root.
+    '''
+
+    def __init__(self, contents, max_workers=8):
+        self.contents = contents
+        self.nodes = {}
+        self.graphs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def files(self, root):
+        '''The root and the files it includes, in inclusion order'''
+        with self.lock:
+            cached = self.graphs.get(root)
+        if cached is not None:
+            files, versions = cached
+            if list(self.executor.map(self.contents.version, files)) == versions:
+                return list(files)
+
+        files, versions = self._walk(root)
+        with self.lock:
+            self.graphs[root] = (files, versions)
+        return list(files)
+
+    # ------
+
+    def _walk(self, root):
+        root_dir = os.path.dirname(root)
+        nodes = {}
+        includeonly = None
+        frontier = [(root, root_dir)]
+        while frontier:
+            results = self.executor.map(
+                lambda item: self._node(item[0], item[1], root_dir), frontier)
+            next_frontier = []
+            queued = set()
+            for (path, base), node in zip(frontier, results):
+                nodes[path] = node
+                if path == root:
+                    includeonly = node[2]
+                for cmd, name, child, child_base in node[1]:
+                    if excluded(cmd, name, includeonly):
+                        continue
+                    if child not in nodes and child not in queued:
+                        queued.add(child)
+                        next_frontier.append((child, child_base))
+            frontier = next_frontier
+
+        # Depth-first, in document order, skipping the cycles
+        files = []
+        visited = set()
+
+        def visit(path, ancestors):
+            visited.add(path)
+            files.append(path)
+            ancestors.add(path)
+            for cmd, name, child, child_base in nodes[path][1]:
+                if excluded(cmd, name, includeonly):
+                    continue
+                if child in ancestors or child in visited or child not in nodes:
+                    continue
+                visit(child, ancestors)
+            ancestors.discard(path)
+
+        visit(root, set())
+        versions = [nodes[f][0] for f in files]
+        return files, versions
+
+    def _node(self, path, base, root_dir):
+        '''(version, includes, includeonly) of a file'''
+        version = self.contents.version(path)
+        key = (path, base)
+        with self.lock:
+            cached = self.nodes.get(key)
+        if cached is not None and cached[0] == version:
+            return cached
+        commands, includeonly = self._scan(path, version)
+        includes = resolve_includes(commands, path, base, root_dir)
+        node = (version, includes, None if includeonly is None else set(includeonly))
+        with self.lock:
+            self.nodes[key] = node
+        return node
+
+    def _scan(self, path, version):
+        '''Include commands of a file, from the symbol cache if it is unchanged'''
+        cache = get_symbol_cache()
+        on_disk = cache is not None and version is not None and version[0] != "buffer"
+        if on_disk:
+            entry = cache.get(path, version[0], version[1])
+            if entry is not None and "includes" in entry:
+                return entry["includes"], entry["includeonly"]
+        text = self.contents.get_text(path)
+        commands, includeonly = scan_includes(text or "")
+        if on_disk and text is not None:
+            cache.update(path, version[0], version[1],
+                         includes=commands, includeonly=includeonly)
+        return commands, includeonly
+
+# ------------------------------
+
+
+def scan_includes(text):
+    '''
+    The [command, name, directory] of the include commands of text (the
+    directory is that of \\import and \\subimport, None otherwise), and the
+    names given to \\includeonly (None if absent). As they only depend on
+    the text, they are stored in the symbol cache.
+    '''
+    index = get_text_index(text)
+    commands = []
+    includeonly = None
+    for m in include_re.finditer(text):
+        if m.lastgroup is None:
+            # Escaped character or comment
+            continue
+        if index.uses_comment_package and index.in_comment_block(m.start()):
+            continue
+        if m.group("only") is not None:
+            includeonly = sorted({name.strip() for name in m.group("only").split(",")})
+        elif m.group("cmd") is not None:
+            commands.append([m.group("cmd"), m.group("file").strip(), None])
+        else:
+            commands.append([m.group("imp"), m.group("ifile").strip(),
+                             m.group("dir").strip()])
+    return commands, includeonly
+
+# ------------------------------
+
+
+def resolve_includes(commands, path, base, root_dir):
+    '''The (command, name, path, base directory) of the included files found'''
+    file_dir = os.path.dirname(path)
+    includes = []
+    for cmd, name, rel_dir in commands:
+        if rel_dir is None:
+            dirs = [file_dir, base] if cmd == "subfile" else [base, root_dir]
+            child_base = base
+        else:
+            start_dir = file_dir if cmd == "subimport" else root_dir
+            child_base = os.path.normpath(os.path.join(start_dir, rel_dir))
+            dirs = [child_base]
+        child = resolve_tex_file(name, dirs)
+        if child:
+            includes.append((cmd, name, child, child_base))
+    return includes
+
+# ------------------------------
+
+
+def excluded(cmd, name, includeonly):
+    '''Whether an \\include is left out by \\includeonly'''
+    return cmd == "include" and includeonly is not None and name not in includeonly
+
+# ------------------------------
+
+
+def resolve_tex_file(name, dirs):
+    '''Path of the .tex file name, looked for in the given directories'''
+    if not name:
+        return None
+    if not name.endswith(".tex"):
+        name += ".tex"
+    for d in dirs:
+        full_path = os.path.normpath(os.path.join(d, name))
+        if os.path.isfile(full_path):
+            return full_path
+    return None
+
+# ------------------------------
+
+
+include_graph = IncludeGraph(file_contents)
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import deque
+
+
+class Cancelled(Exception):
+    '''Raised at a checkpoint of a job which has been superseded'''
+
+
+class Job:
+    '''A submitted job: its key and its generation for that key'''
+
+    def __init__(self, queue, key, generation):
+        self.queue = queue
+        self.key = key
+        self.generation = generation
+
+    def is_current(self):
+        '''Whether no newer job (or cancellation) has been submitted for the key'''
+        return self.queue.generation(self.key) == self.generation
+
+    def checkpoint(self):
+        '''To be called regularly by long jobs: stops them once superseded'''
+        if not self.is_current():
+            raise Cancelled()
+
+
+class JobQueue:
+    '''
+    Background work done by a single worker thread, in order.
+    Each job has a key (e.g. an outline view): submitting a job, or
+    cancelling, starts a new generation for the key. The older jobs of
+    the key are then dropped if not started yet, and stopped at their next
+    checkpoint otherwise, so that their stale results are never used.
+    '''
+
+    def __init__(self):
+        self.generations = {}
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def generation(self, key):
+        with self.condition:
+            return self.generations.get(key, 0)
+
+    def submit(self, key, func, *args):
+        '''Runs func(job, *args) in the worker, superseding the jobs of key'''
+        with self.condition:
+            job = Job(self, key, self._next_generation(key))
+            self.pending = deque(p for p in self.pending if p[0].key != key)
+            self.pending.append((job, func, args))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._work, name="LaTeXOutline jobs", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return job
+
+    def cancel(self, key):
+        '''Supersedes the jobs of key, e.g. when its data is replaced'''
+        with self.condition:
+            self._next_generation(key)
+            self.pending = deque(p for p in self.pending if p[0].key != key)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending.clear()
+            self.condition.notify()
+
+    # ------
+
+    def _next_generation(self, key):
+        generation = self.generations.get(key, 0) + 1
+        self.generations[key] = generation
+        return generation
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                job, func, args = self.pending.popleft()
+            if not job.is_current():
+                continue
+            try:
+                func(job, *args)
+            except Cancelled:
+                pass
+            except Exception as e:
+                print("LaTeXOutline: error in a background job\n{}".format(e))
+
+# ------------------------------
+
+
+jobs = JobQueue()
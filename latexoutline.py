@@ -1,10 +1,25 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import os
 import sublime
-import time
-from sublime_plugin import TextCommand, WindowCommand, EventListener
+from sublime_plugin import (
+    TextCommand, WindowCommand, EventListener, TextChangeListener)
 from .lo_functions import *
+from .symbol_cache import set_cache_dir
+from . import file_watcher
+from .job_queue import jobs
+from .outline_model import get_model, set_model, drop_model
+
+
+def plugin_loaded():
+    set_cache_dir(os.path.join(sublime.cache_path(), 'LaTeXOutline'))
+
+
+def plugin_unloaded():
+    file_watcher.unwatch_all()
+    jobs.stop()
+
 
 # ----------------------------------------------------------------------------#
 #                                                                             #
@@ -32,7 +47,7 @@ class LatexOutlineCommand(WindowCommand):
             
             outline_type = next_in_cycle(current_type, outline_cycle)
 
-            current_symlist = lo_view.settings().get('symlist')
+            model = get_model(lo_view.id())
             path = lo_view.settings().get('current_file')
 
             if side != current_side:
@@ -42,9 +57,9 @@ class LatexOutlineCommand(WindowCommand):
                 show_outline(self.window, side=side, 
                              outline_type=new_outline_type, path=path)
                 lo_view, lo_group = get_sidebar_view_and_group(self.window)
-                lo_view.settings().set('symlist', current_symlist)
+                set_model(lo_view.id(), model)
                 lo_view.settings().set('active_view', self.window.active_view().id())
-                fill_sidebar(lo_view, current_symlist, new_outline_type)
+                fill_sidebar(lo_view, new_outline_type)
 
             else:
                 if outline_type == current_type:
@@ -56,7 +71,7 @@ class LatexOutlineCommand(WindowCommand):
                     new_outline_type = None
 
                 if new_outline_type:
-                    fill_sidebar(lo_view, current_symlist, new_outline_type)
+                    fill_sidebar(lo_view, new_outline_type)
                     lo_view.settings().set('current_outline_type', new_outline_type)
             
         # Open it otherwise
@@ -85,6 +100,7 @@ class LatexOutlineCloseSidebarCommand(WindowCommand):
             self.window.set_layout(lo_new_layout)
             self.window.focus_view(active_view)
             self.window.destroy_output_panel('lo_takealook')
+            file_watcher.retain(displayed_roots())
 
 
 # ----------------------------------------------------
@@ -137,6 +153,34 @@ class LatexOutlineSyncEventHandler(EventListener):
         sublime.set_timeout_async(sync_lo_view, 1000)
 
 
+# ----------------------------------------------------#
+#                 Live update handler                 #
+# ----------------------------------------------------#
+
+class LatexOutlineLiveEventHandler(TextChangeListener):
+
+# ------- 
+# Patches the outline while the LaTeX file is being edited
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        # The syntax may not be set yet: the view is checked on each change
+        return True
+
+    def on_text_changed(self, changes):
+        view = self.buffer.primary_view()
+        if view is None or view.window() is None:
+            return
+        if not view.match_selector(0, "text.tex.latex"):
+            return
+        lo_settings = sublime.load_settings('latexoutline.sublime-settings')
+        if not lo_settings.get('live_update', True):
+            return
+        if not get_sidebar_status(view.window()):
+            return
+        queue_live_edits(view, [(c.a.pt, c.b.pt, len(c.str)) for c in changes])
+
+
 # ----------------------------------------------------#
 #                   Main event handler                #
 # ----------------------------------------------------#
@@ -155,11 +199,13 @@ class LatexOutlineEventHandler(EventListener):
         lo_view, lo_group = get_sidebar_view_and_group(view.window())
 
         if lo_view is not None:
-            if (view.file_name() is not None 
+            # The model is empty in a new session, the outline is filled again
+            model = get_model(lo_view.id())
+            if (view.file_name() is not None and model.version > 0
                     and lo_view.settings().get('current_file') == view.file_name()):
                 return
-            tex_files = lo_view.settings().get('file_list')
-            if (view.file_name() is not None and tex_files is not None
+            tex_files = model.files
+            if (view.file_name() is not None and tex_files
                     and view.file_name() in tex_files):
                 lo_view.settings().set('current_file', view.file_name())
                 lo_view.settings().set('active_view', view.id())
@@ -188,8 +234,8 @@ class LatexOutlineEventHandler(EventListener):
                 lo_view.settings().set('current_file', view.file_name())
 
         outline_type = lo_view.settings().get('current_outline_type')
-        sym_list = light_refresh(lo_view, view, outline_type)
-        fill_sidebar(lo_view, sym_list, outline_type)
+        light_refresh(lo_view, view, outline_type)
+        fill_sidebar(lo_view, outline_type)
         sync_lo_view()
 
 # ------- 
@@ -218,29 +264,25 @@ class LatexOutlineEventHandler(EventListener):
         lo_view_sel = lo_view.sel()[0]
         (row, col) = lo_view.rowcol(lo_view.sel()[0].begin())
         sel_scope = lo_view.scope_name(lo_view.sel()[0].begin())
-        
-        # Refresh the regions (only) in the symlist
-        refresh_regions(lo_view, current_view)
+
         outline_type = lo_view.settings().get('current_outline_type')
-        full_symlist = lo_view.settings().get('symlist')
+        model = get_model(lo_view.id())
         alt_clicked = lo_view.settings().get('alt_clicked')
         if alt_clicked is None:
             alt_clicked = False
         lo_view.settings().set('alt_clicked', False)
 
         type_nb = level_filter(outline_type)
-        symlist = [sym for sym in full_symlist if sym["level"] <= type_nb]
+        symlist = model.visible(type_nb)
 
-        is_title = any([s for s in symlist if s["type"] == "title"])
+        is_title = any([s for s in symlist if s.type == "title"])
         if is_title and row != 0:
             row -= 1
 
         # Get the region corresponding to the selected item
         if not symlist or row is None:
             return None
-        file = symlist[row]["file"]
-        region = symlist[row]["region"]
-        start = region[0]
+        file = symlist[row].file
         
         target_view = None
         for v in sublime.active_window().views():
@@ -248,11 +290,17 @@ class LatexOutlineEventHandler(EventListener):
                 target_view = v
                 break
 
+        # The current region of the item, if its file is open
+        if target_view:
+            refresh_regions(lo_view, target_view)
+        region = symlist[row].region
+        start = region[0]
+
         # If the copy symbol ❐ was pressed
         if 'copy' in sel_scope:
-            label = symlist[row]["content"]
+            label = symlist[row].content
             if alt_clicked:
-                is_equation = symlist[row]["is_equation"]
+                is_equation = symlist[row].is_equation
                 if is_equation:
                     copied_label = "\\eqref{" + label + "}"
                 else:
@@ -296,6 +344,9 @@ class LatexOutlineEventHandler(EventListener):
             lo_side = lo_view.settings().get('side')
             lo_new_layout = reduce_layout(window, lo_view, lo_group, lo_side)
             window.settings().set('lo_new_layout', lo_new_layout)
+        untrack_regions(view)
+        jobs.cancel(view.id())
+        drop_model(view.id())
 
     def on_close(self, view):
         window = sublime.active_window()
@@ -303,21 +354,7 @@ class LatexOutlineEventHandler(EventListener):
             return
         window.set_layout(window.settings().get('lo_new_layout'))
         window.settings().erase('lo_new_layout')
-
-# -------------- 
-# Completely refresh the view after .tex has been built (with build command)
-
-    def on_post_window_command(self, window, command_name, args):
-        if (not window.active_view() 
-                or not window.active_view().match_selector(0, "text.tex.latex")):
-            return
-        if not get_sidebar_status(window):
-            return
-        if command_name != "build":
-            return
-        path = window.active_view().file_name()
-        aux_file = os.path.splitext(path)[0] + ".aux"
-        refresh_with_new_aux(aux_file, window, i=0, step=0)
+        file_watcher.retain(displayed_roots())
 
 # -------------------
 
@@ -0,0 +1,635 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Outline engine: everything needed to compute the outline of a LaTeX document,
+independently of Sublime Text. From the Packages directory:
+
+    python3 -m LaTeXOutline.lo_engine main.tex > outline.json
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from collections import deque
+from functools import lru_cache
+from .parse_aux import load_aux_tree, aux_tree_files, extract_brace_group
+from .parse_out import iter_out_entries, bookmark_title
+from .detect_environment import (
+    find_innermost_envs, env_name, find_env_pairs)
+from .text_index import get_text_index, in_comment_block, comment_or_escape_pattern
+from .symbol_cache import get_symbol_cache, set_cache_dir, content_hash
+from .file_contents import file_contents
+from .include_graph import include_graph, scan_includes
+from .outline_model import Symbol
+
+# -------------------------- Characters --------------------------
+# Changes here should also be reported in latexoutline.sublime-syntax
+# Suggestions: ▪ ⌑ ⦾ ⁌ ∙ ◦ ⦿ ■ 𑗕 ◉ • ⸱ ‣ ▫ ⊙ ⊛ ⏺ ʘ ⏿ ◎ ⦿ ⌖
+lo_chars = {
+    'part': '■',
+    'chapter': '𑗕',
+    'section': '⏺',
+    'subsection': '⊛',
+    'subsubsection': '‣',
+    'paragraph': '⸱',
+    'frametitle': '▫',
+    'label': '›',
+    'copy': '❐',
+    'takealook': '⌖'}
+
+# --------------------- Detected symbols -------------------------
+# pattern / name / level
+symbols_list = [
+    ("title", "title", -1),
+    ("label", "label", 20),
+    ("part", "part", 0),
+    ("chapter", "chapter", 1),
+    ("section", "section", 2),
+    ("subsection", "subsection", 3),
+    ("subsubsection", "subsubsection", 4),
+    ("paragraph", "paragraph", 5),
+    ("frametitle", "frametitle", 3),
+]
+
+# ------------------- Some regex patterns -----------------------
+eq_pattern = re.compile(r'''
+    (align|alignat|aligned|alignedat|displaymath
+    |eqnarray|equation|flalign|gather|gathered
+    |math|multline|x?xalignat|split
+    |dmath|dseries|dgroup|darray|dsuspend)(\*)?
+''', re.VERBOSE)
+symbols_levels = {s[0]: s[2] for s in symbols_list}
+# A single scanner for all the symbols, which skips the comments
+symbols_re = re.compile(
+    comment_or_escape_pattern
+    + r"|\\(" + "|".join(s[0] for s in symbols_list) + r")(\*)?\s*(?:\[[^\]]*\])?\{")
+
+# ----------------------------------------------------------------
+
+# ----------------------------------------------------------------------------#
+#                                                                             #
+#                               MAIN FUNCTIONS                                #
+#                                                                             #
+# ----------------------------------------------------------------------------#
+
+
+def build_outline(path, show_ref_nb=True, show_env_names=True):
+    '''
+    The fully resolved outline of the document whose root file is path:
+    the included files and the symbols, with refs and environment names
+    '''
+    base_symlist, tex_files = get_symbols(path)
+    symlist = build_symlist(base_symlist, path, show_ref_nb, show_env_names)
+    if show_env_names:
+        add_env_names(symlist, tex_files, path, show_env_names)
+    return {"root": path, "files": tex_files, "symlist": symlist}
+
+
+# --------------------------
+
+def build_symlist(base_symlist, path, show_ref_nb, show_env_names):
+    '''
+    Generates a fully new list of the symbols in the file, with their refs
+    (from the .aux file) and their presentation in the outline
+    '''
+    shift = outline_shift(item["type"] for item in base_symlist)
+    aux_data = get_aux_file_data(path)
+    section_queues = aux_data.section_queues() if aux_data else {}
+
+    symlist = []
+    for item in base_symlist:
+        rgn = item["region"]
+        sym = item["content"]
+        type = item["type"]
+        file = item["file"]
+        level = item["level"]
+
+        if show_ref_nb and aux_data:
+            ref = get_ref(sym, type, aux_data, section_queues)
+        else:
+            ref = None
+
+        is_equation = False
+
+        fancy_content = new_lo_line(sym, ref, type, is_equation=is_equation, 
+                                    show_ref_nb=show_ref_nb, 
+                                    show_env_names=show_env_names, shift=shift)
+
+        # Creates the entry of the generated symbol list
+        symlist.append(Symbol((rgn[0], rgn[1]), type, sym, file, level, ref=ref,
+                              is_equation=is_equation, fancy_content=fancy_content))
+
+    return symlist
+
+
+# --------------------------
+
+def add_env_names(symlist, tex_files, path, show_env_names, checkpoint=None):
+    '''
+    Adds the environment names to the labels, and the section names
+    from the .out file, in place.
+    checkpoint() is called before each file, to let a background job stop
+    '''
+    shift = outline_shift(sym.type for sym in symlist)
+    add_section_titles(symlist, path, shift, show_env_names)
+
+    # Indices of the labels, by file
+    labels = {}
+    for i, sym in enumerate(symlist):
+        if sym.type == "label":
+            labels.setdefault(sym.file, []).append(i)
+
+    for file_path in tex_files:
+        if file_path not in labels:
+            continue
+        if checkpoint is not None:
+            checkpoint()
+        contents = get_contents_from_latex_file(file_path)
+        if contents is None:
+            continue
+        # Look for matching \\begin{...}/\\end{...} pairs in the document
+        pairs = get_env_pairs(file_path, contents)
+        indices = labels[file_path]
+        envs = find_innermost_envs(pairs, [symlist[i].region[0] for i in indices])
+
+        for i, env in zip(indices, envs):
+            sym = symlist[i]
+            name = env_name(contents, env[0]) if env else None
+
+            if name is None or name == "document":
+                env_type = " ↪ Ref."
+                is_equation = False
+            else:
+                is_equation = equation_test(name)
+                env_type = name.title()
+
+            sym.env_type = env_type
+            sym.is_equation = is_equation
+            sym.fancy_content = new_lo_line(
+                                    sym.content,
+                                    sym.ref, 
+                                    sym.type, 
+                                    is_equation,
+                                    env_type=env_type,
+                                    show_ref_nb=True,
+                                    show_env_names=show_env_names,
+                                    shift=shift)
+
+    return symlist
+
+
+# --------------------------
+
+def add_section_titles(symlist, path, shift, show_env_names):
+    '''Adds the section names from the .out file, in place'''
+    out_data = get_out_file_data(path, {sym.type for sym in symlist})
+    if not out_data:
+        return symlist
+
+    for sym in symlist:
+        if sym.type in ("label", "title"):
+            continue
+        # Bookmarks with the same type and ref are used in order
+        titles = out_data.get((sym.type, sym.ref))
+        if titles:
+            new_content = bookmark_title(sym.ref, titles.popleft())
+            sym.fancy_content = new_lo_line(
+                                    new_content,
+                                    sym.ref, 
+                                    sym.type, 
+                                    False,
+                                    env_type="",
+                                    show_ref_nb=True,
+                                    show_env_names=show_env_names,
+                                    shift=shift)
+
+    return symlist
+
+
+# --------------------------
+
+def update_refs(symlist, path, show_ref_nb, show_env_names):
+    '''
+    Resolves the refs of the symbols again, from the .aux and .out files
+    (after a build), without scanning the LaTeX files: the environment
+    names found before are kept. In place
+    '''
+    shift = outline_shift(sym.type for sym in symlist)
+    aux_data = get_aux_file_data(path)
+    section_queues = aux_data.section_queues() if aux_data else {}
+
+    for sym in symlist:
+        if show_ref_nb and aux_data:
+            sym.ref = get_ref(sym.content, sym.type, aux_data, section_queues)
+        else:
+            sym.ref = None
+
+        if sym.env_type:
+            # Label whose environment is known
+            sym.fancy_content = new_lo_line(sym.content, sym.ref, sym.type,
+                                            sym.is_equation, env_type=sym.env_type,
+                                            show_ref_nb=True,
+                                            show_env_names=show_env_names, shift=shift)
+        else:
+            sym.fancy_content = new_lo_line(sym.content, sym.ref, sym.type,
+                                            is_equation=False, show_ref_nb=show_ref_nb,
+                                            show_env_names=show_env_names, shift=shift)
+
+    if show_env_names:
+        add_section_titles(symlist, path, shift, show_env_names)
+    return symlist
+
+
+# --------------------------
+
+def project_files(path, tex_files):
+    '''The files whose changes affect the outline of path: .aux, .out and .tex'''
+    base = os.path.splitext(path)[0]
+    return aux_tree_files(base + ".aux") + [base + ".out"] + list(tex_files)
+
+
+# --------------------------
+
+def render_lines(symlist, outline_type):
+    '''Lines of the outline view, for the given outline type'''
+    type_nb = level_filter(outline_type)
+    return [item.fancy_content for item in symlist if item.level <= type_nb]
+
+
+# --------------------------------------------------------------------------#
+#                                                                           #
+#                          Intermediate functions                           #
+#                                                                           #
+# --------------------------------------------------------------------------#
+
+
+def outline_shift(types):
+    '''Indentation of the sections, depending on the presence of parts/chapters'''
+    types = set(types)
+    if "part" in types:
+        return 2
+    elif "chapter" in types:
+        return 1
+    return 0
+
+# --------------------------
+
+def get_symbols(file_path):
+    tex_files = get_all_latex_files(file_path)
+    all_symbols = []
+    comment_pkg_in = False
+    for f in tex_files:
+        data = get_file_data(f)
+        if data:
+            more_symbols = data["symbols"]
+            # Exclude parts commented with the comment package
+            if not comment_pkg_in and data["uses_comment_package"]:
+                comment_pkg_in = True
+            if comment_pkg_in and data["comment_blocks"]:
+                blocks = data["comment_blocks"]
+                more_symbols = [item for item in more_symbols 
+                                if not in_comment_block(blocks, item["region"][0])]
+        else:
+            more_symbols = []
+        # Symbols come in document order, files in inclusion order
+        all_symbols.extend(more_symbols)
+    return all_symbols, tex_files
+
+# --------------------------
+
+def get_file_data(file_path):
+    '''
+    Symbols and comment blocks of a LaTeX file.
+    They are taken from the symbol cache when the file has not changed.
+    '''
+    buffer_text = file_contents.buffer_text(file_path)
+    if buffer_text is not None:
+        # Unsaved changes: the cache describes the file on disk
+        return scan_file(buffer_text, file_path)
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    cache = get_symbol_cache()
+    entry = cache.get(file_path, st.st_mtime_ns, st.st_size) if cache else None
+
+    if entry is None:
+        content = file_contents.disk_text(file_path)
+        if not content:
+            return None
+        digest = content_hash(content)
+        if cache:
+            entry = cache.get_by_hash(file_path, st.st_mtime_ns, st.st_size, digest)
+        if entry is None:
+            data = scan_file(content, file_path)
+            if not cache:
+                return data
+            # The includes are stored too, for the include graph
+            includes, includeonly = scan_includes(content)
+            entry = cache.put(file_path, st.st_mtime_ns, st.st_size, digest,
+                              includes=includes, includeonly=includeonly, **data)
+
+    return {"symbols": [dict(sym) for sym in entry["symbols"]],
+            "comment_blocks": [tuple(b) for b in entry["comment_blocks"]],
+            "uses_comment_package": entry["uses_comment_package"]}
+
+# --------------------------
+
+def scan_file(content, file_path):
+    index = get_text_index(content)
+    return {"symbols": extract_symbols_from_content(content, file_path),
+            "comment_blocks": index.comment_blocks,
+            "uses_comment_package": index.uses_comment_package}
+
+# --------------------------
+
+def extract_symbols_from_content(content, file_path):
+    '''
+    Finds the sectioning commands and labels in a single pass over the content,
+    skipping comments. The symbols are returned in document order.
+    '''
+    symbols = []
+    for match in symbols_re.finditer(content):
+        cmd_name = match.group(1)
+        if cmd_name is None:
+            # Escaped character or comment
+            continue
+        has_star = match.group(2)
+        sym_type = cmd_name + (has_star or "")
+
+        brace_start = match.end() - 1
+        group = extract_brace_group(content, brace_start)
+        if group is None:
+            # Unbalanced braces
+            continue
+        name, brace_end = group
+        if name:
+            symbols.append({
+                "content": name,
+                "type": sym_type,
+                "file": file_path,
+                "region": [match.start(), brace_end],
+                "level": symbols_levels[cmd_name],
+            })
+
+    return symbols
+
+# --------------------------
+
+def get_all_latex_files(file_path):
+    '''The file and all the files it includes (recursively), in order'''
+    return include_graph.files(file_path)
+
+# --------------------------
+
+def get_contents_from_latex_file(file_path):
+    '''Current contents of the file, unsaved changes included'''
+    return file_contents.get_text(file_path)
+
+# --------------------------
+
+def get_env_pairs(file_path, contents):
+    '''
+    Matching \\begin{...}/\\end{...} pairs of a file, from the symbol cache
+    when the file has not changed
+    '''
+    cache = get_symbol_cache()
+    st = None
+    if cache and file_contents.buffer_text(file_path) is None:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            pass
+    if st:
+        entry = cache.get(file_path, st.st_mtime_ns, st.st_size)
+        if entry and "env_pairs" in entry:
+            return [(tuple(b), tuple(e)) for b, e in entry["env_pairs"]]
+
+    pairs = find_env_pairs(contents)
+
+    if st:
+        cache.update(file_path, st.st_mtime_ns, st.st_size, env_pairs=pairs)
+    return pairs
+
+# --------------------------
+
+def get_aux_file_data(path):
+    '''
+    Given a .tex file, gather information from the .aux file
+    (and from the .aux files of the \\include'd files)
+    '''
+    if path:
+        aux_file = os.path.splitext(path)[0] + ".aux"
+        if os.path.exists(aux_file):
+            all_data = load_aux_tree(aux_file)
+            return all_data
+    else:
+        return None
+
+# --------------------------
+
+def get_ref(sym, type, aux_data, section_queues):
+    '''
+    Obtains the reference of the entry.
+    The sections take the next number of their type in section_queues
+    (see AuxData.section_queues).
+    '''
+    
+    ref = None
+
+    # Labels
+    if type == "label":
+        ref = aux_data.labels.get(sym, '*')
+    # Sections
+    elif type != "title":
+        # Minimal check, this is very unprecise, but should work in most cases
+        queue = section_queues.get(type)
+        if queue:
+            ref = queue.popleft()
+
+    return ref
+
+
+# --------------------------
+
+def get_out_file_data(path, entry_types=None):
+    '''
+    Given a .tex file, gather information from the .out file:
+    the titles (not decoded) of the bookmarks of the given types,
+    in FIFO queues indexed by (type, ref)
+    '''
+    if path:
+        out_file = os.path.splitext(path)[0] + ".out"
+        if os.path.exists(out_file):
+            out_data = {}
+            for entry_type, ref, raw_title, num in iter_out_entries(out_file, entry_types):
+                out_data.setdefault((entry_type, ref), deque()).append(raw_title)
+            return out_data
+    else:
+        return None
+
+# --------------------------
+
+# Cleaning of the titles: \emph, \textbf, \mbox and \label are removed
+emph_re = re.compile(r'\\(emph|textbf)\{([^}]*)\}')
+label_cmd_re = re.compile(r'\\label\{[^\}]*\}\s*')
+mbox_re = re.compile(r'\\mbox\{([^\}]*)\}')
+tilde_re = re.compile(r'\s*~\s*')
+
+
+def simplify_title(text, tilde):
+    '''Removes the formatting commands of text, its ~ being replaced by tilde'''
+    if '\\' in text:
+        text = emph_re.sub(r'\2', text)
+        text = label_cmd_re.sub('', text)
+        text = mbox_re.sub(r'\1', text)
+    if '~' in text:
+        text = tilde_re.sub(tilde, text)
+    return text
+
+
+@lru_cache(maxsize=None)
+def line_prefixes(shift):
+    '''The prefixes of the lines of the outline for a given shift of the levels'''
+    return {
+        "title": "❝",
+        "part": lo_chars['part'] + ' ',
+        "chapter": (' ' if shift == 2 else '') + lo_chars['chapter'] + ' ',
+        "section": ' ' * shift + lo_chars['section'] + ' ',
+        "subsection": ' ' * (shift + 1) + lo_chars['subsection'] + ' ',
+        "subsubsection": ' ' * (shift + 2) + lo_chars['subsubsection'] + ' ',
+        "paragraph": ' ' * (shift + 3) + lo_chars['paragraph'] + ' ',
+        "frametitle": lo_chars['frametitle'] + ' ',
+        "label": '  ' + lo_chars['label'],
+        "copy": ' ' + lo_chars['copy'],
+        "takealook": ' ' + lo_chars['takealook'] + ' ',
+    }
+
+
+@lru_cache(maxsize=16384)
+def new_lo_line(sym, ref, type, is_equation=False,
+                env_type="Ref.", show_ref_nb=False, show_env_names=False, shift=0):
+    '''
+    Creates the content to be displayed
+    (memoized: an unchanged outline is rendered again at almost no cost)
+    '''
+    
+    prefix = line_prefixes(shift)
+    postfix = {"title" : "❞",}
+    # Labels
+    if type == "label":
+        if show_ref_nb:
+            if ref and is_equation:
+                new_sym_line = (prefix["label"] + 'Eq. (' + ref +')'
+                                + prefix["copy"] + prefix["takealook"] + '{' + sym + '}')
+            elif ref:
+                new_sym_line = (prefix["label"] + env_type + ' ' + ref 
+                                + prefix["copy"] + prefix["takealook"] + '{' + sym + '}')
+            else:
+                new_sym_line = (prefix["label"] + env_type + ' *' 
+                                + prefix["copy"] + prefix["takealook"] + '{' + sym + '}')
+        elif show_env_names:
+            new_sym_line = (prefix["label"] + env_type + ' ' + prefix["copy"] 
+                            + prefix["takealook"] + '{' + sym + '}')
+        else:
+            new_sym_line = prefix["label"] + sym + prefix["copy"] + prefix["takealook"]
+    # Sections
+    elif type == "title":
+        new_sym_line = prefix["title"] + sym + postfix["title"] +"\n"
+    else:
+        simple_sym = simplify_title(sym, ' ')
+        if '*' in type:
+            new_sym_line = prefix[type[:-1]] + '* ' + simple_sym + prefix["takealook"]
+        elif show_ref_nb and ref:
+            new_sym_line = prefix[type] + ref + ' ' + simple_sym + prefix["takealook"]
+        else:
+            new_sym_line = prefix[type] + simple_sym + prefix["takealook"]
+
+        new_sym_line = simplify_title(new_sym_line, '')
+
+    return new_sym_line
+
+# --------------------------
+
+def new_symlist_item(sym, path, show_ref_nb, show_env_names, shift):
+    '''
+    Entry of the symlist for a symbol found since the last full refresh
+    (its reference is unknown until the next build)
+    '''
+    is_equation = False
+    fancy_content = new_lo_line(sym["content"], "…", sym["type"], 
+                                is_equation, show_ref_nb=show_ref_nb, 
+                                show_env_names=show_env_names, 
+                                shift=shift)
+    return Symbol(sym["region"], sym["type"], sym["content"], path,
+                  get_symbol_level(sym["type"]), ref="…", is_equation=is_equation,
+                  fancy_content=fancy_content)
+
+# --------------------------
+
+def base_symbol_key(sym):
+    '''Key of a symbol found by the scan, as symbol_key of the outline model'''
+    return (sym["file"], sym["type"], sym["content"])
+
+# --------------------------
+
+def equation_test(type):
+    return bool(eq_pattern.match(type))
+
+# --------------------------
+
+def get_symbol_level(symbol):
+    for pattern in symbols_list:
+        if symbol == pattern[0]:
+            return pattern[2]
+    return 999
+
+# --------------------------
+
+def level_filter(outline_type):
+    label_level = get_symbol_level("label")
+    if outline_type == "toc":
+        type_nb = label_level - 1
+    elif outline_type == "full":
+        type_nb = label_level
+    else:
+        type_nb = get_symbol_level(outline_type)
+    return type_nb
+
+# ----------------------------------------------------------------------------#
+#                                                                             #
+#                               COMMAND LINE                                  #
+#                                                                             #
+# ----------------------------------------------------------------------------#
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prints the outline of a LaTeX document as JSON.")
+    parser.add_argument("path", help="root .tex file of the document")
+    parser.add_argument("--outline-type", default="full",
+                        help="toc, full, section, subsection, etc. (default: full)")
+    parser.add_argument("--no-ref-numbers", action="store_true",
+                        help="do not read the refs from the .aux file")
+    parser.add_argument("--no-env-names", action="store_true",
+                        help="do not look for environment names")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory of the persistent symbol cache (default: none)")
+    args = parser.parse_args(argv)
+
+    set_cache_dir(args.cache_dir)
+    path = os.path.abspath(args.path)
+    outline = build_outline(path, show_ref_nb=not args.no_ref_numbers,
+                            show_env_names=not args.no_env_names)
+    outline["lines"] = render_lines(outline["symlist"], args.outline_type)
+    outline["symlist"] = [sym.to_dict() for sym in outline["symlist"]]
+    json.dump(outline, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
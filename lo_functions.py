@@ -1,62 +1,21 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import os
+import difflib
 import sublime
 from sublime_plugin import TextCommand
-import re
-import time
-import unicodedata
 from sublime import Region
-from .parse_aux import parse_aux_file, extract_brace_group
-from .parse_out import parse_out_file
-from .detect_environment import (
-    find_env_regions, filter_non_comment_regions, match_envs,
-    begin_re, end_re, is_comment)
-import threading
-
-# -------------------------- Characters --------------------------
-# Changes here should also be reported in latexoutline.sublime-syntax
-# Suggestions: ▪ ⌑ ⦾ ⁌ ∙ ◦ ⦿ ■ 𑗕 ◉ • ⸱ ‣ ▫ ⊙ ⊛ ⏺ ʘ ⏿ ◎ ⦿ ⌖
-lo_chars = {
-    'part': '■',
-    'chapter': '𑗕',
-    'section': '⏺',
-    'subsection': '⊛',
-    'subsubsection': '‣',
-    'paragraph': '⸱',
-    'frametitle': '▫',
-    'label': '›',
-    'copy': '❐',
-    'takealook': '⌖'}
-
-# --------------------- Detected symbols -------------------------
-# pattern / name / level
-symbols_list = [
-    ("title", "title", -1),
-    ("label", "label", 20),
-    ("part", "part", 0),
-    ("chapter", "chapter", 1),
-    ("section", "section", 2),
-    ("subsection", "subsection", 3),
-    ("subsubsection", "subsubsection", 4),
-    ("paragraph", "paragraph", 5),
-    ("frametitle", "frametitle", 3),
-]
-
-# ------------------- Some regex patterns -----------------------
-eq_pattern = re.compile(r'''
-    (align|alignat|aligned|alignedat|displaymath
-    |eqnarray|equation|flalign|gather|gathered
-    |math|multline|x?xalignat|split
-    |dmath|dseries|dgroup|darray|dsuspend)(\*)?
-''', re.VERBOSE)
-part_pattern = re.compile(r"^Part")
-chap_pattern = re.compile(r"^Chapter:")
-symbols_patterns = [(re.compile(rf"\\({s[0]})(\*)?\s*(?:\[[^\]]*\])?\{{"), s[1], s[2])
-                    for s in symbols_list]
-
-# ----------------------------------------------------------------
+from .lo_engine import (
+    build_symlist, add_env_names, outline_shift, update_refs,
+    get_symbols, get_all_latex_files, get_contents_from_latex_file,
+    extract_symbols_from_content, new_symlist_item, get_symbol_level, level_filter,
+    project_files, base_symbol_key)
+from .file_contents import file_contents
+from .job_queue import jobs
+from .outline_model import (
+    get_model, find_model, file_ids, diff_keys, diff_symbols, symbol_key,
+    shift_regions, LiveEdits)
+from . import file_watcher
 
 # ----------------------------------------------------------------------------#
 #                                                                             #
@@ -97,59 +56,20 @@ def show_outline(window, side="right", outline_type="toc", path=None):
 def fill_symlist(base_symlist, path, view, lo_view):
     '''
     Generates a fully new list of the symbols in the file
-    Prepares their presentation in the LO view, puts it in the 'symlist' setting
+    Prepares their presentation in the LO view, puts it in the model of the view
     '''
     lo_settings = sublime.load_settings('latexoutline.sublime-settings')
     show_ref_nb = lo_settings.get('show_ref_numbers')
     show_env_names = lo_settings.get('show_environments_names')
 
-    shift = 0
-    if any(part_pattern.search(b["type"]) for b in base_symlist):
-        shift = 2
-    elif any(chap_pattern.search(b["type"]) for b in base_symlist):
-        shift = 1
-
-    aux_data = get_aux_file_data(path)
-
-    symlist = []
-    for item in base_symlist:
-        rgn = item["region"]
-        sym = item["content"]
-        type = item["type"]
-        file = item["file"]
-        level = item["level"]
-
-        if show_ref_nb and aux_data:
-            ref = get_ref(sym, type, aux_data)
-        else:
-            ref = None
-
-        is_equation = False
-
-        fancy_content = new_lo_line(sym, ref, type, is_equation=is_equation, 
-                                    show_ref_nb=show_ref_nb, 
-                                    show_env_names=show_env_names, shift=shift)
-
-        # Creates the entry of the generated symbol list
-        symlist.append(
-            {"region": (rgn[0], rgn[1]),
-             "type": type,
-             "content": sym,
-             "is_equation": is_equation,
-             "file": file, 
-             "fancy_content": fancy_content,
-             "ref": ref,
-             "level": level,
-             "env_type": ""}
-            )
-
-    lo_view.settings().erase('symlist')
-    lo_view.settings().set('symlist', symlist)
+    symlist = build_symlist(base_symlist, path, show_ref_nb, show_env_names)
+    get_model(lo_view.id()).set_symbols(symlist)
 
     # Getting environment names can take some time; better let it in the background
     if show_env_names:
-        thread = GetEnvNamesTask(view)
-        thread.start()
+        jobs.submit(lo_view.id(), outline_job, lo_view, view, False)
+    else:
+        jobs.cancel(lo_view.id())
 
     return symlist
 
@@ -161,7 +81,9 @@ def refresh_lo_view(lo_view, path, view, outline_type):
 
     # Get the section/label list
     symlist, tex_files = get_symbols(path)
-    new_sym_list = fill_symlist(symlist, path, view, lo_view)
+    discard_live_edits(tex_files)
+    get_model(lo_view.id()).files = tex_files
+    fill_symlist(symlist, path, view, lo_view)
     active_view_id = view.id()
 
     if lo_view is not None:
@@ -170,33 +92,113 @@ def refresh_lo_view(lo_view, path, view, outline_type):
             lo_view.settings().set('active_view', active_view_id)
         if path:
             lo_view.settings().set('current_file', path)
-        lo_view.settings().set('file_list', tex_files)
+        watch_project(tex_files[0] if tex_files else path, tex_files)
         # Fills the sidebar contents
-        fill_sidebar(lo_view, new_sym_list, outline_type)
+        fill_sidebar(lo_view, outline_type)
         view.settings().set('sync_in_progress', False)
         sync_lo_view()
 
 
 # --------------------------
 
-def fill_sidebar(lo_view, sym_list, outline_type):
-    '''Fills the contents of the outline view'''
+def fill_sidebar(lo_view, outline_type):
+    '''
+    Fills the contents of the outline view, from its model
+    (the command reads the lines from the model, they are not passed to it)
+    '''
+    model = get_model(lo_view.id())
     lo_view.run_command('latex_outline_fill_sidebar', 
-                        {'symlist': sym_list, 'outline_type': outline_type})
+                        {'model_id': lo_view.id(), 'version': model.version,
+                         'type_nb': level_filter(outline_type)})
+    track_regions(lo_view)
 
 # ------
 
 class LatexOutlineFillSidebarCommand(TextCommand):
-    '''Text command for the latter'''
-    def run(self, edit, symlist=None, outline_type="full"):
+    '''
+    Text command for the latter: only the lines which differ from the
+    current contents are replaced, in one edit
+    '''
+    def run(self, edit, model_id=None, version=None, type_nb=None):
         
-        type_nb = level_filter(outline_type)
-        symlist_contents = [item["fancy_content"] for item in symlist 
-                                if item["level"] <= type_nb]
-        self.view.erase(edit, Region(0, self.view.size()))
-        self.view.insert(edit, 0, "\n".join(symlist_contents))
+        model = find_model(model_id)
+        # A stale request: the model has changed since, and will be shown again
+        if model is None or model.version != version:
+            return
+        new_lines = "\n".join(model.lines(type_nb)).split("\n")
+        old_lines = self.view.substr(Region(0, self.view.size())).split("\n")
+        for a, b, text in reversed(line_edits(old_lines, new_lines)):
+            self.view.replace(edit, Region(a, b), text)
         self.view.sel().clear()
-       
+
+# ------
+
+def line_edits(old_lines, new_lines):
+    '''
+    The (begin, end, new text) replacements turning the text of old_lines
+    into that of new_lines (joined with newlines), in increasing order
+    '''
+    # The unchanged lines at both ends are left out of the comparison
+    n = min(len(old_lines), len(new_lines))
+    first = 0
+    while first < n and old_lines[first] == new_lines[first]:
+        first += 1
+    last = 0
+    while (last < n - first
+           and old_lines[-1 - last] == new_lines[-1 - last]):
+        last += 1
+    old_middle = old_lines[first:len(old_lines) - last]
+    new_middle = new_lines[first:len(new_lines) - last]
+    if not old_middle and not new_middle:
+        return []
+
+    # Offsets of the lines; the text has no final newline
+    starts = [0]
+    for line in old_lines:
+        starts.append(starts[-1] + len(line) + 1)
+    size = starts[-1] - 1
+
+    edits = []
+    for i1, i2, j1, j2 in line_blocks(old_middle, new_middle):
+        a, b = starts[first + i1], starts[first + i2]
+        text = "".join(line + "\n" for line in new_middle[j1:j2])
+        if b > size:
+            # The last line has no newline to replace
+            if a > size:
+                a = b = size
+                text = "\n" + text[:-1]
+            elif text:
+                b = size
+                text = text[:-1]
+            else:
+                a, b = max(a - 1, 0), size
+        edits.append((a, b, text))
+    return edits
+
+# ------
+
+# Above this number of lines, the differing parts are replaced as a whole
+max_diff_lines = 2000
+
+
+def line_blocks(old_lines, new_lines):
+    '''The (i1, i2, j1, j2) blocks of old_lines to replace by blocks of new_lines'''
+    if len(old_lines) == len(new_lines):
+        # E.g. new refs or environment names: the lines are compared in pairs
+        blocks = []
+        for i, (old, new) in enumerate(zip(old_lines, new_lines)):
+            if old == new:
+                continue
+            if blocks and blocks[-1][1] == i:
+                blocks[-1][1] = blocks[-1][3] = i + 1
+            else:
+                blocks.append([i, i + 1, i, i + 1])
+        return blocks
+    if len(old_lines) + len(new_lines) > max_diff_lines:
+        return [(0, len(old_lines), 0, len(new_lines))]
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [(i1, i2, j1, j2) for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != "equal"]
 
 # --------------------------
 
@@ -213,37 +215,26 @@ def sync_lo_view():
     type_nb = level_filter(outline_type)
 
     view = sublime.active_window().active_view()
-    
-    # Refresh the regions (only) in the current symlist
-    refresh_regions(lo_view, view)
-    settings_sym_list = lo_view.settings().get('symlist')
+    model = get_model(lo_view.id())
 
-    sym_list = [item for item in settings_sym_list
-                    if item["level"] <= type_nb]
-    
-    point = view.sel()[0].end()
-    file_path = view.file_name()
-    partial_symlist = [s for s in sym_list if s["file"] == file_path]
+    # The positions of the symbols of the file, as tracked in the view
+    indices, regions = tracked_symbols(lo_view, view)
     
-    if len(partial_symlist) >0: 
-        range_lows = [view.line(item['region'][0]).begin() for item in partial_symlist]
-        range_sorted = [0] + range_lows[1:len(range_lows)] + [view.size()]
-        partial_index = binary_search(range_sorted, point) - 1
-        lo_line = sym_list.index(partial_symlist[partial_index])
+    lo_line = 0
+    if len(indices) > 0:
+        # The last symbol starting on the line of the cursor or before
+        line_end = view.line(view.sel()[0].end()).end()
+        partial_index = max(bisect_regions(regions, line_end) - 1, 0)
+        lo_line = max(model.visible_rows(type_nb)[indices[partial_index]], 0)
 
         # Highlight the previous (sub)section rather than the label
-        max_level = min(type_nb, label_level - 1)
         if outline_type != "toc":
-            for i in range(lo_line, -1, -1):
-                if sym_list[i]["level"] <= max_level:
-                    lo_line = i
-                    break
+            heading_rows = model.heading_rows(type_nb, min(type_nb, label_level - 1))
+            if lo_line < len(heading_rows):
+                lo_line = heading_rows[lo_line]
         # A shift if there is a title
-        is_title = any([s for s in sym_list if s["type"] == "title"])
-        if is_title and lo_line != 0:
+        if model.has_title() and lo_line != 0:
             lo_line += 1
-    else:
-        lo_line=0
 
     lo_point_start = lo_view.text_point_utf8(lo_line, 0)
     lo_view.show_at_center(lo_point_start, animate=True)
@@ -255,232 +246,168 @@ def sync_lo_view():
 
     view.settings().set('sync_in_progress', False)
 
+# --------------------------
 
-# --------------------------------------------------------------------------#
-#                                                                           #
-#                          Intermediate functions                           #
-#                                                                           #
-# --------------------------------------------------------------------------#
+def outline_job(job, lo_view, active_view, with_refs):
+    '''
+    Background completion of the outline: environment names (and section
+    names from the .out file), after resolving the refs again if with_refs.
+    Runs in the job queue, the result is dropped if a newer job was submitted
+    '''
+    model = get_model(lo_view.id())
+    if not model.symbols:
+        return
+    symlist = [sym.copy() for sym in model.symbols]
+    lo_settings = sublime.load_settings('latexoutline.sublime-settings')
+    show_ref_nb = lo_settings.get('show_ref_numbers')
+    show_env_names = lo_settings.get('show_environments_names')
 
+    path = lo_view.settings().get('current_file')
+    tex_files = model.files
 
-def get_ref(sym, type, aux_data):
-    '''Obtains the reference of the entry'''
-    
-    ref = None
-
-    # Labels
-    if type == "label":
-        ref = next((entry['reference'] for entry in aux_data
-                    if sym == entry['main_content']), '*')
-    # Sections
-    elif type != "title":
-        for i, data_item in enumerate(aux_data):
-            if data_item['entry_type'] != type or data_item['reference'] == '':
-                continue
-            # Minimal check, this is very unprecise, but should work in most cases
-            # ts = normalize_for_comparison(sym)
-            # if ts == normalize_for_comparison(data_item['main_content']):
-            correct_item = aux_data.pop(i)
-            ref = correct_item['reference']
-            break
+    if not tex_files:
+        tex_files = get_all_latex_files(active_view.file_name())
 
-    return ref
+    if with_refs:
+        path = tex_files[0]
+        update_refs(symlist, path, show_ref_nb, show_env_names)
+    # After a new build, only the labels whose environment is unknown need it
+    if show_env_names and (not with_refs or any(
+            sym.type == "label" and not sym.env_type for sym in symlist)):
+        add_env_names(symlist, tex_files, path, show_env_names, checkpoint=job.checkpoint)
 
+    job.checkpoint()
+    sublime.set_timeout(lambda: apply_job_result(job, lo_view, symlist))
 
-# --------------------------
+# ------
 
-def new_lo_line(sym, ref, type, is_equation=False,
-                env_type="Ref.", show_ref_nb=False, show_env_names=False, shift=0):
-    '''Creates the content to be displayed'''
-    
-    prefix = {
-        "title": "❝",
-        "part": lo_chars['part'] + ' ',
-        "chapter": (' ' if shift == 2 else '') + lo_chars['chapter'] + ' ',
-        "section": ' ' * shift + lo_chars['section'] + ' ',
-        "subsection": ' ' * (shift + 1) + lo_chars['subsection'] + ' ',
-        "subsubsection": ' ' * (shift + 2) + lo_chars['subsubsection'] + ' ',
-        "paragraph": ' ' * (shift + 3) + lo_chars['paragraph'] + ' ',
-        "frametitle": lo_chars['frametitle'] + ' ',
-        "label": '  ' + lo_chars['label'],
-        "copy": ' ' + lo_chars['copy'],
-        "takealook": ' ' + lo_chars['takealook'] + ' ',
-    }
-    postfix = {"title" : "❞",}
-    # Labels
-    if type == "label":
-        if show_ref_nb:
-            if ref and is_equation:
-                new_sym_line = (prefix["label"] + 'Eq. (' + ref +')'
-                                + prefix["copy"] + prefix["takealook"] + '{' + sym + '}')
-            elif ref:
-                new_sym_line = (prefix["label"] + env_type + ' ' + ref 
-                                + prefix["copy"] + prefix["takealook"] + '{' + sym + '}')
-            else:
-                new_sym_line = (prefix["label"] + env_type + ' *' 
-                                + prefix["copy"] + prefix["takealook"] + '{' + sym + '}')
-        elif show_env_names:
-            new_sym_line = (prefix["label"] + env_type + ' ' + prefix["copy"] 
-                            + prefix["takealook"] + '{' + sym + '}')
-        else:
-            new_sym_line = prefix["label"] + sym + prefix["copy"] + prefix["takealook"]
-    # Sections
-    elif type == "title":
-        new_sym_line = prefix["title"] + sym + postfix["title"] +"\n"
-    else:
-        simple_sym = re.sub(r'\\(emph|textbf)\{([^}]*)\}', r'\2', sym)
-        simple_sym = re.sub(r'\\label\{[^\}]*\}\s*', '', simple_sym)
-        simple_sym = re.sub(r'\\mbox\{([^\}]*)\}', r'\1', simple_sym)
-        simple_sym = re.sub(r'\s*~\s*', r' ', simple_sym)
-        if '*' in type:
-            new_sym_line = prefix[type[:-1]] + '* ' + simple_sym + prefix["takealook"]
-        elif show_ref_nb and ref:
-            new_sym_line = prefix[type] + ref + ' ' + simple_sym + prefix["takealook"]
-        else:
-            new_sym_line = prefix[type] + simple_sym + prefix["takealook"]
+def apply_job_result(job, lo_view, symlist):
+    '''
+    Copies the refs and presentation computed by a job into the current
+    symlist, which may have been edited meanwhile (matching the symbols by
+    file, type and content)
+    '''
+    if not job.is_current() or not lo_view.is_valid():
+        return
+    model = get_model(lo_view.id())
+    current = model.symbols
+    if not current:
+        return
+    refresh_all_regions(lo_view)
+    for i, j in diff_symbols(current, symlist).pairs():
+        sym, result = current[i], symlist[j]
+        sym.ref = result.ref
+        sym.env_type = result.env_type
+        sym.is_equation = result.is_equation
+        sym.fancy_content = result.fancy_content
+
+    model.changed()
+    outline_type = lo_view.settings().get('current_outline_type')
+    fill_sidebar(lo_view, outline_type)
 
-        new_sym_line = re.sub(r'\\(emph|textbf)\{([^}]*)\}', r'\2', new_sym_line)
-        new_sym_line = re.sub(r'\\label\{[^\}]*\}\s*', '', new_sym_line)
-        new_sym_line = re.sub(r'\\mbox\{([^\}]*)\}', r'\1', new_sym_line)
-        new_sym_line = re.sub(r'\s*~\s*', r'', new_sym_line)
+        
+# --------------------------
 
-    return new_sym_line
+def refresh_regions(lo_view, view):
+    '''
+    Merely refresh the regions of the symbols of the file of the view,
+    from the positions tracked by Sublime Text through the edits
+    '''
+    symbols = get_model(lo_view.id()).symbols
+    indices, regions = tracked_symbols(lo_view, view)
+    for i, rgn in zip(indices, regions):
+        symbols[i].region = (rgn.a, rgn.b)
 
+# ------
 
-# --------------------------
-class GetEnvNamesTask(threading.Thread):
-    def __init__(self, active_view):
-        super().__init__()
-        self.active_view = active_view
+def refresh_all_regions(lo_view):
+    '''Refresh the regions of the symbols in all the views they are tracked in'''
+    window = lo_view.window()
+    if window is None:
+        return
+    tracked = get_model(lo_view.id()).tracked
+    for view in window.views():
+        if view.id() in tracked:
+            refresh_regions(lo_view, view)
 
-    def run(self):
+# ------
 
-        lo_view, lo_group = get_sidebar_view_and_group(sublime.active_window())
-        if not lo_view:
-            return
-        symlist = lo_view.settings().get('symlist')
-        lo_settings = sublime.load_settings('latexoutline.sublime-settings')
-        show_env_names = lo_settings.get('show_environments_names')
-
-        path = lo_view.settings().get('current_file')
-        out_data = get_out_file_data(path)
-
-        shift = 0
-        if "part" in [sym["type"] for sym in symlist]:
-            shift = 2
-        elif "chapter" in [sym["type"] for sym in symlist]:
-            shift = 1
-
-        tex_files = lo_view.settings().get('file_list')
-
-        if len(tex_files) == 0:
-            tex_files = get_all_latex_files(self.active_view.file_name())
-            
-        for file_path in tex_files:
-            if not os.path.exists(file_path):
-                pass
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    contents = f.read()
-            except:  
-                pass
-            # Look for matching \begin{...}/\end{...} pairs in the document
-            st_begins = [(m.start(), m.end()) for m in re.finditer(begin_re, contents)]
-            st_ends = [(m.start(), m.end()) for m in re.finditer(end_re, contents)]
-            begins = filter_non_comment_regions(contents, st_begins)
-            ends = filter_non_comment_regions(contents, st_ends)
-            pairs = match_envs(contents, begins, ends)
-
-            for i in range(len(symlist)):
-                sym = symlist[i]
-                if sym["file"] != file_path:
-                    continue
-
-                if sym["type"] != "label":
-                    if out_data is not None and len(out_data)>0 and sym["type"] != "title":
-                        # Adds section names from the .out file
-                        for l, data in enumerate(out_data):
-                            if data[0] == sym["type"] and data[1] == sym["ref"]:
-                                new_content = data[2]
-                                out_data.pop(l)
-                                symlist[i]["fancy_content"] = new_lo_line(
-                                                                new_content,
-                                                                sym["ref"], 
-                                                                sym["type"], 
-                                                                False,
-                                                                env_type="",
-                                                                show_ref_nb=True,
-                                                                show_env_names=show_env_names,
-                                                                shift=shift)
-                                break
-                    else:
-                        continue
-                else:
-                    rgn = sym["region"]
-                    env_regions = find_env_regions(contents, rgn[0], pairs)
-
-                    if (len(env_regions) == 0 
-                            or contents[env_regions[0][0]:env_regions[0][1]] == "document"):
-                        env_type = " ↪ Ref."
-                        is_equation = False
-                    else:
-                        env_type = contents[env_regions[0][0]:env_regions[0][1]]
-                        is_equation = equation_test(env_type)
-                        env_type = env_type.title()
-
-                    symlist[i]["env_type"] = env_type
-                    symlist[i]["is_equation"] = is_equation
-                    symlist[i]["fancy_content"] = new_lo_line(
-                                                    sym["content"],
-                                                    sym["ref"], 
-                                                    sym["type"], 
-                                                    is_equation,
-                                                    env_type=env_type,
-                                                    show_ref_nb=True,
-                                                    show_env_names=show_env_names,
-                                                    shift=shift)
-
-        # If it changed in the meantime
-        lo_view, lo_group = get_sidebar_view_and_group(sublime.active_window())
-        if lo_view:
-            lo_view.settings().set('symlist', symlist)
-            outline_type = lo_view.settings().get('current_outline_type')
-            fill_sidebar(lo_view, symlist, outline_type)
+def tracking_key(lo_view):
+    return 'latexoutline_symbols_{}'.format(lo_view.id())
 
-        
-# --------------------------
+# ------
 
-def refresh_regions(lo_view, active_view):
+def track_regions(lo_view):
     '''
-    Merely refresh the regions in the symlist
+    Registers the regions of the symbols in the open views of their files,
+    where Sublime Text keeps them up to date through the edits
     '''
-    in_sync = lo_view.settings().get('regions_refreshed_recently')
-    if in_sync:
+    window = lo_view.window()
+    if window is None:
         return
-    lo_view.settings().set('regions_refreshed_recently', True)
-    path = active_view.file_name()
-    symlist = lo_view.settings().get('symlist')
-    content = active_view.substr(sublime.Region(0, active_view.size()))
-    new_symlist = extract_symbols_from_content(content, path)
-
-    for i in range(0, len(symlist)-1):
-        if symlist[i]["file"] != path:
-            pass
-        first = None
-        item = symlist[i]
-        for k, it in enumerate(new_symlist):
-            if it["content"] == item["content"]:
-                first = new_symlist.pop(k)
-                break      
-
-        if first:
-            region = first["region"]
-            symlist[i]["region"] = region
-
-    lo_view.settings().set('symlist', symlist)
-    sublime.set_timeout(
-        lambda: lo_view.settings().set('regions_refreshed_recently', False), 20000)
-    return 
+    for view in window.views():
+        if view.id() != lo_view.id():
+            tracked_symbols(lo_view, view)
+
+# ------
+
+def track_view(lo_view, view):
+    '''Registers the regions of the symbols of the file of the view'''
+    model = get_model(lo_view.id())
+    indices = model.file_index().get(file_ids.get(view.file_name()), ())
+    key = tracking_key(lo_view)
+    if not indices:
+        if model.tracked.pop(view.id(), None) is not None:
+            view.erase_regions(key)
+        return indices
+    symbols = model.symbols
+    view.add_regions(key, [Region(symbols[i].start, symbols[i].end) for i in indices],
+                     flags=sublime.HIDDEN)
+    model.tracked[view.id()] = (model.version, indices)
+    return indices
+
+# ------
+
+def untrack_regions(lo_view):
+    '''Removes the regions registered for the outline view'''
+    window = lo_view.window()
+    if window is None:
+        return
+    key = tracking_key(lo_view)
+    for view in window.views():
+        view.erase_regions(key)
+
+# ------
+
+def tracked_symbols(lo_view, view):
+    '''
+    The indices of the symbols of the file of the view and their tracked regions
+    (registered first if needed), both in the order of the file
+    '''
+    model = get_model(lo_view.id())
+    key = tracking_key(lo_view)
+    tracked = model.tracked.get(view.id())
+    if tracked is not None and tracked[0] == model.version:
+        indices = tracked[1]
+        regions = view.get_regions(key)
+        # The regions are lost e.g. when the file is reverted
+        if len(regions) == len(indices):
+            return indices, regions
+    indices = track_view(lo_view, view)
+    return indices, view.get_regions(key) if indices else []
+
+# ------
+
+def bisect_regions(regions, x):
+    '''Number of the (sorted) regions starting at x or before'''
+    low, high = 0, len(regions)
+    while low < high:
+        mid = (low + high) // 2
+        if regions[mid].a <= x:
+            low = mid + 1
+        else:
+            high = mid
+    return low
 
 # --------------------------
 
@@ -488,66 +415,139 @@ def light_refresh(lo_view, active_view, outline_type):
     '''
     Refresh the regions, add new/remove old entries
     '''
-    symlist = lo_view.settings().get('symlist')
+    model = get_model(lo_view.id())
+    symlist = model.symbols
     lo_settings = sublime.load_settings('latexoutline.sublime-settings')
     show_ref_nb = lo_settings.get('show_ref_numbers')
     show_env_names = lo_settings.get('show_environments_names')
     path = active_view.file_name()
     unfiltered_st_symlist, tex_files = get_symbols(path)
-
-    shift = 0
-    if "part" in [sym["type"] for sym in symlist]:
-        shift = 2
-    elif "chapter" in [sym["type"] for sym in symlist]:
-        shift = 1
-
-    new_symlist = []
-    for sym in unfiltered_st_symlist:
-        item = {}
-        key_unfound = True
-        for i in range(len(symlist)):
-            if sym["content"] == symlist[i]["content"]:
-                reg = symlist[i]["region"]
-                item=symlist.pop(i)
-                item["region"] = reg
-                key_unfound = False
-                break
-
-        if key_unfound:
-            is_equation = False
-            fancy_content = new_lo_line(sym["content"], "…", sym["type"], 
-                                        is_equation, show_ref_nb=show_ref_nb, 
-                                        show_env_names=show_env_names, 
-                                        shift=shift)
-            item = {"region": sym["region"],
-                    "type": sym["type"],
-                    "content": sym["content"],
-                    "is_equation": is_equation,
-                    "fancy_content": fancy_content,
-                    "file": path,
-                    "ref": "…",
-                    "level": get_symbol_level(sym["type"]),
-                    "env_type": ""}
-
-        new_symlist.append(item)
+    discard_live_edits(tex_files)
+
+    diff = diff_keys([symbol_key(sym) for sym in symlist],
+                     [base_symbol_key(sym) for sym in unfiltered_st_symlist])
+    for i, j in diff.pairs():
+        symlist[i].region = unfiltered_st_symlist[j]["region"]
+    if diff.is_empty():
+        return symlist
+
+    shift = outline_shift(sym.type for sym in symlist)
+    new_symlist = [None] * len(unfiltered_st_symlist)
+    for i, j in diff.pairs():
+        new_symlist[j] = symlist[i]
+    for j in diff.added:
+        new_symlist[j] = new_symlist_item(
+            unfiltered_st_symlist[j], path, show_ref_nb, show_env_names, shift)
         
-    lo_view.settings().set('symlist', new_symlist)
+    model.set_symbols(new_symlist)
     return new_symlist
 
 # --------------------------
 
+# Edits waiting to be applied to the outline
+live_edits = LiveEdits()
+# Extra characters read after an edited line, for titles spanning several lines
+live_margin = 2000
+
+
+def queue_live_edits(view, edits):
+    '''
+    Records the (begin, end, inserted length) edits made to the view
+    and schedules their application to the outline
+    '''
+    if live_edits.add(view.id(), edits):
+        sublime.set_timeout(lambda: apply_live_edits(view), 300)
+
+# ------
+
+def discard_live_edits(tex_files):
+    '''Drops the pending edits of the files, which have just been scanned in full'''
+    files = set(tex_files)
+    live_edits.discard([view.id() for window in sublime.windows()
+                        for view in window.views() if view.file_name() in files])
+
+# ------
+
+def apply_live_edits(view):
+    '''
+    Patches the symlist after some edits of the view: the symbols after an edit
+    are shifted, and only the edited lines are scanned again
+    '''
+    edits = live_edits.take(view.id())
+    path = view.file_name()
+    if not edits or not path or not view.window():
+        return
+    lo_view, lo_group = get_sidebar_view_and_group(view.window())
+    if not lo_view:
+        return
+    model = get_model(lo_view.id())
+    symlist = model.symbols
+    tex_files = model.files
+    if not symlist or not tex_files or path not in tex_files:
+        return
+
+    # The symbols of the file are contiguous in the symlist
+    indices = [i for i, sym in enumerate(symlist) if sym.file == path]
+    first = indices[0] if indices else len(symlist)
+    last = indices[-1] + 1 if indices else len(symlist)
+    file_symbols = symlist[first:last]
+
+    # Shift the regions and collect the modified ranges
+    dirty = shift_regions(file_symbols, edits)
+
+    # Scan the modified lines again
+    lo_settings = sublime.load_settings('latexoutline.sublime-settings')
+    show_ref_nb = lo_settings.get('show_ref_numbers')
+    show_env_names = lo_settings.get('show_environments_names')
+    shift = outline_shift(sym.type for sym in symlist)
+
+    size = view.size()
+    removed = []
+    found = []
+    for ds, de in dirty:
+        ds = view.line(min(ds, size)).begin()
+        de = view.line(min(de, size)).end()
+        text = view.substr(sublime.Region(ds, min(de + live_margin, size)))
+        for sym in extract_symbols_from_content(text, path):
+            if sym["region"][0] < de - ds:
+                sym["region"] = [sym["region"][0] + ds, sym["region"][1] + ds]
+                found.append(sym)
+        kept = []
+        for sym in file_symbols:
+            (removed if ds <= sym.region[0] <= de else kept).append(sym)
+        file_symbols = kept
+
+    # Keep the entries (refs, environment names) of the unchanged symbols
+    removed.sort(key=lambda sym: sym.region[0])
+    diff = diff_keys([symbol_key(sym) for sym in removed],
+                     [base_symbol_key(sym) for sym in found])
+    for i, j in diff.pairs():
+        item = removed[i]
+        item.region = found[j]["region"]
+        file_symbols.append(item)
+    for j in diff.added:
+        file_symbols.append(
+            new_symlist_item(found[j], path, show_ref_nb, show_env_names, shift))
+    changed = not diff.is_empty()
+
+    file_symbols.sort(key=lambda sym: sym.region[0])
+    symlist[first:last] = file_symbols
+    if changed:
+        model.changed()
+        outline_type = lo_view.settings().get('current_outline_type')
+        fill_sidebar(lo_view, outline_type)
+
+# --------------------------
+
 def copy_label(active_view, region_position):
     if active_view and region_position:
-        text_from_region = active_view.substr(
-            sublime.Region(region_position[1], active_view.size()))
-
-        label_match = re.search(r'\\label\{([^}]*)\}', text_from_region)
-        command_match = re.search(r'\\\w*\{', text_from_region)
-        if label_match and (
-          not command_match
-          or label_match.start() <= command_match.start()
-        ):
-            label = label_match.group(1)
+        # The label must come before any other command after the section
+        command_rgn = active_view.find(r'\\\w*\{', region_position[1])
+        label_rgn = None
+        if command_rgn and active_view.substr(command_rgn) == '\\label{':
+            label_rgn = active_view.find(r'\\label\{[^}]*\}', command_rgn.begin())
+        if label_rgn and label_rgn.begin() == command_rgn.begin():
+            label = active_view.substr(label_rgn)[len('\\label{'):-1]
             sublime.set_clipboard(label)
             sublime.active_window().status_message(
                 f" ✓ Copied reference '{label}' to the clipboard")
@@ -692,146 +692,27 @@ def get_sidebar_status(window):
 
 # --------------------------
 
-def get_symbols(file_path):
-    tex_files = get_all_latex_files(file_path)
-    all_symbols = []
-    comment_pkg_in = False
-    for f in tex_files:
-        content = get_contents_from_latex_file(f)
-        if content:
-            more_symbols = extract_symbols_from_content(content, f)
-            # Exclude parts commented with the comment package
-            if not comment_pkg_in and uses_comment_package(content):
-                comment_pkg_in = True
-            if comment_pkg_in:
-                comment_blocks = find_comment_blocks(content)
-                more_symbols = [item for item in more_symbols 
-                                if not point_in_block(item["region"][0], comment_blocks)]
-        else:
-            more_symbols = []
-        all_symbols.extend(more_symbols)
-    file_order = {path: index for index, path in enumerate(tex_files)}
-    all_symbols.sort(key=lambda s: (file_order.get(s["file"], 9999), s["region"][0]))
-    return all_symbols, tex_files
+# Text of the modified buffers, by path: (buffer id, change count, text)
+buffer_texts = {}
 
-# --------------------------
 
-def get_aux_file_data(path):
-    '''
-    Given a .tex file, gather information from the .aux file
-    '''
-    if path:
-        aux_file = os.path.splitext(path)[0] + ".aux"
-        if os.path.exists(aux_file):
-            all_data = parse_aux_file(aux_file)
-            return all_data
-    else:
-        return None
-
-# --------------------------
-
-def get_out_file_data(path):
-    '''
-    Given a .tex file, gather information from the .out file
-    '''
-    if path:
-        out_file = os.path.splitext(path)[0] + ".out"
-        if os.path.exists(out_file):
-            out_data = parse_out_file(out_file)
-            return out_data
-    else:
-        return None
-           
-# --------------------------
+def unsaved_buffer_text(path):
+    '''Text of the open view of path, if it has unsaved changes'''
+    for window in sublime.windows():
+        view = window.find_open_file(path)
+        if view is None or view.is_loading() or not view.is_dirty():
+            continue
+        key = (view.buffer_id(), view.change_count())
+        cached = buffer_texts.get(path)
+        if cached is None or cached[0] != key:
+            cached = (key, view.substr(Region(0, view.size())))
+            buffer_texts[path] = cached
+        return cached[1]
+    buffer_texts.pop(path, None)
+    return None
 
-def binary_search(array, x):
-    '''
-    Given a sorted array, returns the location of x if inserted into the array
-    '''
-    low = 0
-    high = len(array) - 1
-    mid = 0
-    while low < high:
-        mid = (high + low) // 2
-        if array[mid] <= x:
-            low = mid + 1
-        else:
-            high = mid
-    return low
 
-# --------------------------
-
-def normalize_for_comparison(s):
-    s = re.sub(r'\n', ' ', s)
-    s = re.sub(r'\$[^\$]*?\$', '', s)
-    s = re.sub(r'\\nonbreakingspace\s+', '~', s)
-    # s = re.sub(r'\\label\{[^\}]*\}\s*', '', s)
-    s = re.sub(r'\\[a-zA-Z]*(?:\{[^\}]*\})\s*', '', s)
-    s = re.sub(r'\s+', ' ', s)
-    s = s.strip()
-    return unicodedata.normalize("NFC", s)
-
-# --------------------------
-
-def get_contents_from_latex_file(file_path):
-
-    if not os.path.exists(file_path):
-        return None
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            return content
-    except:
-        return None
-
-# --------------------------
-
-def extract_symbols_from_content(content, file_path):
-    symbols = []    
-    for sym_regex, base_type, level in symbols_patterns:
-        for match in sym_regex.finditer(content):
-            cmd_name = match.group(1)
-            if is_comment(content, (match.start(),match.end())):
-                continue
-            has_star = match.group(2)
-            sym_type = cmd_name + (has_star or "")
-
-            brace_start = match.end() - 1
-            name, brace_end = extract_brace_group(content, brace_start)
-            if name:
-                symbols.append({
-                    "content": name,
-                    "type": sym_type,
-                    "file": file_path,
-                    "region": [match.start(), brace_end],
-                    "level": level,
-                })
-
-    return symbols
-
-# --------------------------
-
-def get_all_latex_files(file_path):
-    all_files = [file_path]
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        included_files = re.findall(r"\\(?:input|include)\{(.+?)\}", content)
-        base_dir = os.path.dirname(file_path)
-        for rel in included_files:
-            full_path = os.path.join(base_dir, rel)
-            if not full_path.endswith(".tex"):
-                full_path += ".tex"
-            if os.path.exists(full_path):
-                all_files.append(full_path)
-    except:
-        pass
-    return all_files
-
-# --------------------------
-
-def equation_test(type):
-    return bool(eq_pattern.match(type))
+file_contents.set_buffer_source(unsaved_buffer_text)
 
 # --------------------------
 
@@ -882,52 +763,71 @@ def next_in_cycle(item, my_list):
     else:
         return my_list[0]
 
-# --------------------------
+# -------------------
 
-def get_symbol_level(symbol):
-    for pattern in symbols_list:
-        if symbol == pattern[0]:
-            return pattern[2]
-    return 999
+def watch_project(root, tex_files):
+    '''
+    Watches the .aux, .out and .tex files of the project, to update the
+    outline after a build (whatever started it)
+    '''
+    if root:
+        file_watcher.watch(root, project_files(root, tex_files), on_project_change)
+    file_watcher.retain(displayed_roots())
 
-# --------------------------
 
-def level_filter(outline_type):
-    label_level = get_symbol_level("label")
-    if outline_type == "toc":
-        type_nb = label_level - 1
-    elif outline_type == "full":
-        type_nb = label_level
-    else:
-        type_nb = get_symbol_level(outline_type)
-    return type_nb
+def displayed_roots():
+    '''Root files of the outlines shown in the windows'''
+    roots = set()
+    for window in sublime.windows():
+        lo_view, lo_group = get_sidebar_view_and_group(window)
+        if lo_view:
+            tex_files = get_model(lo_view.id()).files
+            if tex_files:
+                roots.add(tex_files[0])
+    return roots
 
-# -------------------
+# ------
 
-def refresh_with_new_aux(aux_file=None, window=None, i=0, step=0):
-    if aux_file is None or window is None:
+def on_project_change(root, changed):
+    # Called from the watcher thread
+    sublime.set_timeout(lambda: project_changed(root, changed))
+
+
+def project_changed(root, changed):
+    '''
+    Updates the outlines of root once its files have changed on disk: only
+    the refs after a build, everything if some .tex file changed
+    '''
+    # The files open in Sublime Text are followed by the live update
+    tex_changed = any(p.endswith(".tex") and not is_open_file(p) for p in changed)
+    # A mere save: the refs are kept until the next build
+    build_changed = any(p.endswith((".aux", ".out")) for p in changed)
+    if not tex_changed and not build_changed:
         return
-    if i < 50:
-        i += 1
-        if os.path.exists(aux_file):
-            modification_time = os.path.getmtime(aux_file)
-            current_time = time.time()
-            if current_time - modification_time < 0.3:
-                new_step = 1
-            else:
-                new_step = 2 if step == 1 else 0
-            if new_step == 2:
-                # .aux file has been recently modified, but not for the past 0.3s
-                lo_view, lo_group = get_sidebar_view_and_group(window)
-                outline_type = lo_view.settings().get('current_outline_type')
-                refresh_lo_view(lo_view, window.active_view().file_name(),
-                                window.active_view(), outline_type)
-                return
+    shown = False
+    for window in sublime.windows():
+        lo_view, lo_group = get_sidebar_view_and_group(window)
+        if not lo_view:
+            continue
+        tex_files = get_model(lo_view.id()).files
+        if not tex_files or tex_files[0] != root:
+            continue
+        shown = True
+        outline_type = lo_view.settings().get('current_outline_type')
+        if tex_changed:
+            active_view_id = lo_view.settings().get('active_view')
+            possible_views = [v for v in window.views() if v.id() == active_view_id]
+            view = possible_views[0] if possible_views else window.active_view()
+            refresh_lo_view(lo_view, root, view, outline_type)
         else:
-            new_step = 0
-        sublime.set_timeout_async(
-            lambda: refresh_with_new_aux(aux_file, window, i, new_step), 300)
-    return
+            view = window.active_view()
+            jobs.submit(lo_view.id(), outline_job, lo_view, view, True)
+    if not shown:
+        file_watcher.retain(displayed_roots())
+
+
+def is_open_file(path):
+    return any(window.find_open_file(path) for window in sublime.windows())
 
 # -------------------
 
@@ -938,58 +838,3 @@ class LoInsertInView(TextCommand):
         self.view.sel().clear()
 
 # -------------------
-
-def uses_comment_package(content):
-
-    pattern = re.compile(r'\\usepackage(?:\[[^\]]*\])?{[^}]*\bcomment\b[^}]*}')
-    for match in pattern.finditer(content):
-        start = match.start()
-        line_start = content.rfind('\n', 0, start) + 1
-        line_end = content.find('\n', start)
-        if line_end == -1:
-            line_end = len(content)
-        line = content[line_start:line_end]
-        if not line.strip().startswith('%'):
-            return True
-    return False
-
-# -------------------
-
-def find_comment_blocks(text):
-    start_tag = r"\begin{comment}"
-    end_tag = r"\end{comment}"
-    stack = []
-    top_level_blocks = []
-
-    index = 0
-    while index < len(text):
-        next_start = text.find(start_tag, index)
-        next_end = text.find(end_tag, index)
-
-        if next_start != -1 and (next_start < next_end or next_end == -1):
-            stack.append(next_start)
-            index = next_start + len(start_tag)
-        elif next_end != -1:
-            if not stack:
-                # Unmatched \\end{comment}
-                break
-            start_pos = stack.pop()
-            if not stack: 
-                top_level_blocks.append((start_pos, next_end + len(end_tag)))
-            index = next_end + len(end_tag)
-        else:
-            break
-
-    # if stack:
-    #  Unmatched \\begin{comment}
-        # pass
-    return top_level_blocks
-
-# -------------------
-
-def point_in_block(point, blocks):
-    for start, end in blocks:
-        if start <= point < end:
-            return True
-    return False
-
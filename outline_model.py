@@ -0,0 +1,433 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sys
+from array import array
+from bisect import bisect_left
+
+# ------- Interned file paths -------
+# The symbols refer to their file by an id, the path being stored once
+
+file_paths = []
+file_ids = {}
+
+
+def file_id(path):
+    fid = file_ids.get(path)
+    if fid is None:
+        fid = file_ids[path] = len(file_paths)
+        file_paths.append(path)
+    return fid
+
+# --------------------------
+
+
+class Symbol:
+    '''
+    An entry of the outline (title, section, label...): where it is,
+    its reference and environment, and its line in the outline view
+    '''
+
+    __slots__ = ("start", "end", "type", "content", "file_id", "level", "ref",
+                 "is_equation", "env_type", "fancy_content")
+
+    def __init__(self, region, type, content, file, level, ref=None,
+                 is_equation=False, env_type="", fancy_content=""):
+        self.start, self.end = region
+        self.type = sys.intern(type)
+        self.content = content
+        self.file_id = file_id(file)
+        self.level = level
+        self.ref = ref
+        self.is_equation = is_equation
+        self.env_type = env_type
+        self.fancy_content = fancy_content
+
+    @property
+    def region(self):
+        return (self.start, self.end)
+
+    @region.setter
+    def region(self, region):
+        self.start, self.end = region
+
+    @property
+    def file(self):
+        return file_paths[self.file_id]
+
+    @file.setter
+    def file(self, path):
+        self.file_id = file_id(path)
+
+    def copy(self):
+        return Symbol(self.region, self.type, self.content, self.file, self.level,
+                      self.ref, self.is_equation, self.env_type, self.fancy_content)
+
+    def to_dict(self):
+        return {"region": list(self.region),
+                "type": self.type,
+                "content": self.content,
+                "is_equation": self.is_equation,
+                "file": self.file,
+                "fancy_content": self.fancy_content,
+                "ref": self.ref,
+                "level": self.level,
+                "env_type": self.env_type}
+
+    def __repr__(self):
+        return "Symbol({!r}, {!r}, {!r})".format(self.type, self.content, self.region)
+
+# --------------------------
+
+
+class OutlineModel:
+    '''
+    The outline shown in an outline view: its symbols and the files of the
+    document. The version is increased whenever the symbols change.
+    The levels of the symbols, the symbols shown for each level filter,
+    the rows used to sync the view and the position indices are computed
+    once per version.
+    '''
+
+    def __init__(self):
+        self.symbols = []
+        self.files = []
+        self.version = 0
+        self.cache_version = -1
+        self.level_array = array("h")
+        self.visible_cache = {}
+        self.lines_cache = {}
+        self.rows_cache = {}
+        self.heading_rows_cache = {}
+        self.title_cache = None
+        self.file_index_cache = None
+        # Views in which the positions of the symbols are tracked:
+        # view id -> (version, indices of the tracked symbols)
+        self.tracked = {}
+
+    def set_symbols(self, symbols, files=None):
+        self.symbols = symbols
+        if files is not None:
+            self.files = list(files)
+        self.changed()
+
+    def changed(self):
+        '''To be called after modifying the symbols in place'''
+        self.version += 1
+
+    def levels(self):
+        '''Levels of the symbols, as an array'''
+        self._check_cache()
+        return self.level_array
+
+    def visible(self, type_nb):
+        '''The symbols shown when the level filter is type_nb'''
+        self._check_cache()
+        shown = self.visible_cache.get(type_nb)
+        if shown is None:
+            symbols = self.symbols
+            shown = self.visible_cache[type_nb] = [
+                symbols[i] for i, level in enumerate(self.level_array) if level <= type_nb]
+        return shown
+
+    def lines(self, type_nb):
+        '''The lines of the outline view when the level filter is type_nb'''
+        self._check_cache()
+        lines = self.lines_cache.get(type_nb)
+        if lines is None:
+            lines = self.lines_cache[type_nb] = [
+                sym.fancy_content for sym in self.visible(type_nb)]
+        return lines
+
+    def visible_rows(self, type_nb):
+        '''
+        For each symbol, the row in the filtered outline of the last symbol
+        shown at or before it (-1 if none)
+        '''
+        self._check_cache()
+        rows = self.rows_cache.get(type_nb)
+        if rows is None:
+            rows = self.rows_cache[type_nb] = array("l")
+            row = -1
+            for level in self.level_array:
+                if level <= type_nb:
+                    row += 1
+                rows.append(row)
+        return rows
+
+    def heading_rows(self, type_nb, max_level):
+        '''
+        For each row of the filtered outline, the last row at or before it
+        whose level is at most max_level (the row itself if none)
+        '''
+        self._check_cache()
+        rows = self.heading_rows_cache.get((type_nb, max_level))
+        if rows is None:
+            rows = self.heading_rows_cache[(type_nb, max_level)] = array("l")
+            heading = -1
+            shown = (level for level in self.level_array if level <= type_nb)
+            for row, level in enumerate(shown):
+                if level <= max_level:
+                    heading = row
+                rows.append(row if heading < 0 else heading)
+        return rows
+
+    def has_title(self):
+        '''Whether there is a title (always shown, as the first row)'''
+        self._check_cache()
+        if self.title_cache is None:
+            self.title_cache = any(sym.type == "title" for sym in self.symbols)
+        return self.title_cache
+
+    def file_index(self):
+        '''Indices of the symbols of each file (by file id), in order'''
+        self._check_cache()
+        if self.file_index_cache is None:
+            index = self.file_index_cache = {}
+            for i, sym in enumerate(self.symbols):
+                index.setdefault(sym.file_id, array("l")).append(i)
+        return self.file_index_cache
+
+    def _check_cache(self):
+        if self.cache_version != self.version:
+            self.level_array = array("h", (sym.level for sym in self.symbols))
+            self.visible_cache = {}
+            self.lines_cache = {}
+            self.rows_cache = {}
+            self.heading_rows_cache = {}
+            self.title_cache = None
+            self.file_index_cache = None
+            self.cache_version = self.version
+
+# --------------------------
+
+
+class LiveEdits:
+    '''
+    The edits of the views waiting to be applied to the outline, by view id.
+    They are dropped when the symbols of the view are scanned again in full,
+    since the scan already sees them.
+    '''
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, view_id, edits):
+        '''Records (begin, end, inserted length) edits; True if none were pending'''
+        pending = self.pending.setdefault(view_id, [])
+        first = not pending
+        pending.extend(edits)
+        return first
+
+    def take(self, view_id):
+        '''The pending edits of the view, which are no more pending'''
+        return self.pending.pop(view_id, [])
+
+    def discard(self, view_ids):
+        for view_id in view_ids:
+            self.pending.pop(view_id, None)
+
+
+def shift_regions(symbols, edits):
+    '''
+    Moves the regions of the symbols of a file (sorted by start) after some
+    (begin, end, inserted length) edits, in order. Returns the modified
+    ranges, merged: the symbols they contain are to be scanned again.
+    Each edit only visits the symbols it touches: the following ones are
+    moved lazily, by an offset applied from the index lazy on.
+    '''
+    longest = max((sym.end - sym.start for sym in symbols), default=0)
+    lazy, offset = len(symbols), 0
+    dirty = []
+    for a, b, length in edits:
+        delta = length - (b - a)
+        start, end = a, a + length
+        # The symbols which may touch the edit, and those after it
+        first = _bisect_start(symbols, a - longest, lazy, offset)
+        after = _bisect_start(symbols, b, lazy, offset)
+        if after > lazy:
+            _move(symbols, lazy, after, offset)
+            lazy = after
+        if offset == 0:
+            lazy, offset = after, delta
+        else:
+            _move(symbols, after, lazy, delta)
+            offset += delta
+        for sym in symbols[first:after]:
+            if sym.end >= a:
+                # The edit touches the symbol itself: a start in a deleted
+                # span is moved to the edit, in the range scanned again
+                sym.start = _shift_point(sym.start, a, b, a, delta)
+                sym.end = max(_shift_point(sym.end, a, b, end, delta), sym.start)
+                start = min(start, sym.start)
+                longest = max(longest, sym.end - sym.start)
+
+        # The ranges ending before the edit are left as they are
+        i = _bisect_end(dirty, a)
+        tail = [[_shift_point(ds, a, b, a, delta), _shift_point(de, a, b, end, delta)]
+                for ds, de in dirty[i:]]
+        tail.append([start, end])
+        # The previous range may be merged too
+        if i > 0:
+            i -= 1
+            tail.append(dirty[i])
+        dirty[i:] = _merge_ranges(tail)
+    _move(symbols, lazy, len(symbols), offset)
+    return dirty
+
+
+def _bisect_start(symbols, x, lazy, offset):
+    '''Index of the first symbol starting at x or after'''
+    low, high = 0, len(symbols)
+    while low < high:
+        mid = (low + high) // 2
+        if symbols[mid].start + (offset if mid >= lazy else 0) < x:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+def _bisect_end(ranges, x):
+    '''Index of the first of the (sorted, disjoint) ranges ending at x or after'''
+    low, high = 0, len(ranges)
+    while low < high:
+        mid = (low + high) // 2
+        if ranges[mid][1] < x:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+def _move(symbols, begin, end, delta):
+    if delta:
+        for sym in symbols[begin:end]:
+            sym.start += delta
+            sym.end += delta
+
+
+def _shift_point(pt, a, b, inside, delta):
+    '''New position of pt after [a, b] is replaced, inside if pt was in [a, b]'''
+    if pt >= b:
+        return pt + delta
+    if pt >= a:
+        return inside
+    return pt
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+# --------------------------
+
+
+class SymbolDiff:
+    '''
+    Alignment of an old and a new list of symbols, as indices:
+    added (new), removed (old), and the (old, new) pairs of the symbols
+    found in both lists, unchanged or moved (i.e. out of their former order)
+    '''
+
+    __slots__ = ("added", "removed", "unchanged", "moved")
+
+    def __init__(self, added, removed, unchanged, moved):
+        self.added = added
+        self.removed = removed
+        self.unchanged = unchanged
+        self.moved = moved
+
+    def pairs(self):
+        return self.unchanged + self.moved
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.moved)
+
+
+def diff_keys(old_keys, new_keys):
+    '''
+    Aligns two lists of keys such as (file, type, content): the k-th occurrence
+    of a key in the old list is paired with its k-th occurrence in the new one,
+    so that repeated titles ("Proof", "Examples"...) keep their own entries.
+    The pairs kept in order are the longest increasing run of old indices.
+    '''
+    occurrences = {}
+    for i, key in enumerate(old_keys):
+        occurrences.setdefault(key, []).append(i)
+    for indices in occurrences.values():
+        indices.reverse()
+
+    added = []
+    pairs = []
+    for j, key in enumerate(new_keys):
+        indices = occurrences.get(key)
+        if indices:
+            pairs.append((indices.pop(), j))
+        else:
+            added.append(j)
+    removed = sorted(i for indices in occurrences.values() for i in indices)
+
+    # Longest increasing subsequence of the old indices (patience sorting)
+    tails = []
+    tail_pairs = []
+    previous = [-1] * len(pairs)
+    for k, (i, j) in enumerate(pairs):
+        pos = bisect_left(tails, i)
+        if pos == len(tails):
+            tails.append(i)
+            tail_pairs.append(k)
+        else:
+            tails[pos] = i
+            tail_pairs[pos] = k
+        previous[k] = tail_pairs[pos - 1] if pos > 0 else -1
+    in_order = [False] * len(pairs)
+    k = tail_pairs[-1] if tail_pairs else -1
+    while k >= 0:
+        in_order[k] = True
+        k = previous[k]
+
+    unchanged = [pair for pair, kept in zip(pairs, in_order) if kept]
+    moved = [pair for pair, kept in zip(pairs, in_order) if not kept]
+    return SymbolDiff(added, removed, unchanged, moved)
+
+
+def symbol_key(sym):
+    '''Key of a symbol in the diffs'''
+    return (sym.file, sym.type, sym.content)
+
+
+def diff_symbols(old, new):
+    return diff_keys([symbol_key(sym) for sym in old], [symbol_key(sym) for sym in new])
+
+# --------------------------
+
+
+# Models of the outline views, by view id
+models = {}
+
+
+def find_model(view_id):
+    '''The model of the outline view view_id, None if it has none'''
+    return models.get(view_id)
+
+
+def get_model(view_id):
+    '''The model of the outline view view_id (created if needed)'''
+    model = models.get(view_id)
+    if model is None:
+        model = models[view_id] = OutlineModel()
+    return model
+
+
+def set_model(view_id, model):
+    models[view_id] = model
+
+
+def drop_model(view_id):
+    models.pop(view_id, None)
@@ -1,28 +1,60 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import os
 import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Braces, and escaped characters (so that \\{ and \\} are skipped)
+brace_re = re.compile(r'\\.|[{}]', re.S)
+
 
 # --------------------------
 def extract_brace_group(s, start):
-    """Extract content inside balanced braces starting at position `start`."""
+    """
+    Extract content inside balanced braces starting at position `start`.
+    Returns (content, end), or None if the braces are unbalanced.
+    """
     if s[start] != '{':
         raise ValueError("Expected opening brace at position {}".format(start))
 
     depth = 0
-    i = start
-    while i <= len(s):
-        if s[i] == '{':
+    for m in brace_re.finditer(s, start):
+        c = m.group()
+        if c == '{':
             depth += 1
-        elif s[i] == '}':
+        elif c == '}':
             depth -= 1
             if depth == 0:
-                return s[start+1:i], i + 1  # exclude outer braces
-        i += 1
+                return s[start+1:m.start()], m.end()  # exclude outer braces
 
     return None
 
 
+# --------------------------
+def extract_brace_groups(s, start=0):
+    """
+    Contents of all the top-level brace groups of s after `start`, in one pass.
+    Stray closing braces and a final unbalanced group are ignored.
+    """
+    groups = []
+    depth = 0
+    opening = 0
+    for m in brace_re.finditer(s, start):
+        c = m.group()
+        if c == '{':
+            if depth == 0:
+                opening = m.end()
+            depth += 1
+        elif c == '}' and depth > 0:
+            depth -= 1
+            if depth == 0:
+                groups.append(s[opening:m.start()])
+    return groups
+
+
 # --------------------------
 def parse_newlabel_line(line):
     """Parse a line starting with newlabel and extract label info."""
@@ -30,20 +62,9 @@ def parse_newlabel_line(line):
         return None
 
     try:
-        name_start = line.find('{') + 1
-        name_end = line.find('}', name_start)
-        label_name = line[name_start:name_end]
-
-        fields = []
-        i = line.find('{{', name_end)
-        i += 1  # move to the first '{'
-
-        while len(fields) < 5 and i < len(line):
-            if line[i] == '{':
-                field, i = extract_brace_group(line, i)
-                fields.append(field)
-            else:
-                i += 1
+        groups = extract_brace_groups(line)
+        label_name = groups[0]
+        fields = extract_brace_groups(groups[1]) if len(groups) > 1 else []
 
         # type_field = fields[3] if len(fields) > 3 else None
         # type_main, type_sub = None, None
@@ -77,19 +98,14 @@ def parse_writefile_line(line):
 
     line = str(line)
     try:
-        i = line.find('{')
-        file_type, i = extract_brace_group(line, i)
-        content, _ = extract_brace_group(line, i)
+        groups = extract_brace_groups(line)
+        if len(groups) < 2:
+            return None
+        content = groups[1]
 
         if content.startswith('\\contentsline'):
-            j = content.find('{')
-            entry_type, j = extract_brace_group(content, j)
-            raw_text, j = extract_brace_group(content, j)
-            page_number, j = extract_brace_group(content, j)
-
-            # Attempt to extract optional extra field and ignore it
-            while j < len(content) and content[j] == '{':
-                _, j = extract_brace_group(content, j)
+            # The optional extra fields are ignored
+            entry_type, raw_text, page_number = extract_brace_groups(content)[:3]
 
             entry_number = None
             entry_title = raw_text.strip()
@@ -144,23 +160,238 @@ def parse_writefile_line(line):
         print(f"Error parsing \\@writefile: {line.strip()}\n{e}")
         return None
 
+# ---- Indexed entries ----
+
+class AuxData:
+    """
+    Entries of a .aux file, indexed: the references of the labels by name,
+    and the section numbers by entry type, in order of appearance.
+    The \\@input'ed files are listed with the number of entries of each type
+    found before them.
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self.sections = {}
+        self.inputs = []
+
+    def __len__(self):
+        return len(self.labels) + sum(len(refs) for refs in self.sections.values())
+
+    def add(self, entry_type, main_content, reference):
+        if entry_type == 'label':
+            # The first definition of a label wins
+            self.labels.setdefault(main_content, reference)
+        elif reference != '':
+            self.sections.setdefault(entry_type, []).append(reference)
+
+    def add_input(self, name):
+        counts = {entry_type: len(refs) for entry_type, refs in self.sections.items()}
+        self.inputs.append((name, len(self.labels), counts))
+
+    def copy(self):
+        data = AuxData()
+        data.labels = dict(self.labels)
+        data.sections = {entry_type: list(refs) for entry_type, refs in self.sections.items()}
+        data.inputs = list(self.inputs)
+        return data
+
+    def section_queues(self):
+        """Fresh FIFO queues of the section numbers, by entry type."""
+        return {entry_type: deque(refs) for entry_type, refs in self.sections.items()}
+
+
 # ---- Main function ----
 
 def parse_aux_file(filename):
-    """Parse a .aux file and return a list of entries from \newlabel and \\@writefile."""
-    entries = []
+    """Parse a .aux file and return the indexed entries from \newlabel and \\@writefile."""
+    entries = AuxData()
 
     with open(filename, 'r', encoding='utf-8') as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith('\\newlabel'):
-                parsed = parse_newlabel_line(line)
-            elif line.startswith('\\@writefile'):
-                parsed = parse_writefile_line(line)
+        parse_aux_lines(file, entries)
+
+    return entries
+
+
+def parse_aux_lines(lines, entries):
+    """Parse the given lines of a .aux file, adding the entries to an AuxData."""
+    for entry in iter_aux_lines(lines):
+        if entry[0] == '@input':
+            entries.add_input(entry[1])
+        else:
+            entries.add(*entry)
+
+
+# ---- Streaming ----
+
+def iter_aux_lines(lines):
+    """
+    Yields the entries of the given lines of a .aux file as
+    (entry_type, main_content, reference) tuples, in order.
+    The \\@input'ed files are yielded as ('@input', file name, None).
+    Lines of other types are skipped without being parsed.
+    """
+    for line in lines:
+        line = line.strip()
+        if line.startswith('\\newlabel'):
+            parsed = parse_newlabel_line(line)
+        elif line.startswith('\\@writefile'):
+            parsed = parse_writefile_line(line)
+        elif line.startswith('\\@input{'):
+            yield ('@input', line[len('\\@input{'):line.find('}')], None)
+            continue
+        else:
+            continue
+
+        if parsed:
+            yield (parsed['entry_type'], parsed['main_content'], parsed['reference'])
+
+
+# ---- Cached parsing ----
+
+# Number of bytes compared to check that a grown file was only appended to
+check_size = 256
+
+
+class AuxFileCache:
+    """
+    Parsed .aux files, kept as long as their mtime and size do not change.
+    When a file has only grown by appending, only the new lines are parsed.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def load(self, filename):
+        st = os.stat(filename)
+        with self.lock:
+            cached = self.files.get(filename)
+        if (cached is not None and cached['mtime'] == st.st_mtime_ns
+                and cached['size'] == st.st_size):
+            return cached['data']
+
+        with open(filename, 'rb') as f:
+            if cached is not None and st.st_size > cached['size'] and _only_appended(f, cached):
+                data = cached['data'].copy()
+                parsed = cached['parsed']
+                f.seek(parsed)
             else:
-                parsed = None
+                data = AuxData()
+                parsed = 0
+                f.seek(0)
+            new_bytes = f.read()
 
-            if parsed:
-                entries.append(parsed)
+        # Only complete lines are parsed, the rest will be read next time
+        end = new_bytes.rfind(b'\n') + 1
+        parse_aux_lines(new_bytes[:end].decode('utf-8', errors='replace').splitlines(), data)
+        if parsed:
+            head = cached['head']
+            tail = (cached['tail'] + new_bytes[:end])[-check_size:]
+        else:
+            head = new_bytes[:check_size]
+            tail = new_bytes[:end][-check_size:]
+        parsed += end
 
-    return entries
+        with self.lock:
+            self.files[filename] = {'mtime': st.st_mtime_ns, 'size': st.st_size,
+                                    'parsed': parsed, 'head': head, 'tail': tail,
+                                    'data': data}
+        return data
+
+
+def _only_appended(f, cached):
+    """Whether the beginning and the end of the parsed part are unchanged."""
+    head = f.read(len(cached['head']))
+    f.seek(cached['parsed'] - len(cached['tail']))
+    tail = f.read(len(cached['tail']))
+    return head == cached['head'] and tail == cached['tail']
+
+
+aux_cache = AuxFileCache()
+
+
+def load_aux_file(filename):
+    """Indexed entries of a .aux file, parsed again only when it changes."""
+    return aux_cache.load(filename)
+
+
+# ---- Included .aux files ----
+
+aux_executor = ThreadPoolExecutor(max_workers=4)
+# Last merged tree, by root: (files and their AuxData, merged AuxData)
+merged_trees = {}
+
+
+def load_aux_tree(filename):
+    """
+    Indexed entries of a .aux file and of the files it \\@input's (the .aux
+    files of \\include'd chapters), recursively, merged in document order.
+    The files of each level are loaded in parallel, each one being cached.
+    """
+    base_dir = os.path.dirname(filename)
+    loaded = {}
+    frontier = [filename]
+    while frontier:
+        results = aux_executor.map(_load_or_none, frontier)
+        next_frontier = []
+        for path, data in zip(frontier, results):
+            loaded[path] = data
+            for name, _, _ in (data.inputs if data is not None else []):
+                child = os.path.normpath(os.path.join(base_dir, name))
+                if child not in loaded and child not in next_frontier:
+                    next_frontier.append(child)
+        frontier = next_frontier
+
+    cached = merged_trees.get(filename)
+    if (cached is not None and cached[0].keys() == loaded.keys()
+            and all(cached[0][path] is data for path, data in loaded.items())):
+        return cached[1]
+
+    merged = AuxData()
+    _merge_aux(filename, loaded, base_dir, merged, set())
+    merged_trees[filename] = (loaded, merged)
+    return merged
+
+
+def aux_tree_files(filename):
+    """The .aux files found in the last load of the tree of filename."""
+    cached = merged_trees.get(filename)
+    return list(cached[0]) if cached is not None else [filename]
+
+
+def _load_or_none(filename):
+    try:
+        return load_aux_file(filename)
+    except OSError:
+        return None
+
+
+def _merge_aux(path, loaded, base_dir, merged, ancestors):
+    """Adds the entries of path to merged, those of its inputs at their place."""
+    data = loaded.get(path)
+    if data is None or path in ancestors:
+        return
+    ancestors.add(path)
+    labels = list(data.labels.items())
+    labels_done = 0
+    done = {}
+
+    def add_entries(nb_labels, counts):
+        nonlocal labels_done
+        for label, ref in labels[labels_done:nb_labels]:
+            merged.labels.setdefault(label, ref)
+        labels_done = nb_labels
+        for entry_type, refs in data.sections.items():
+            count = counts.get(entry_type, 0) if counts is not None else len(refs)
+            start = done.get(entry_type, 0)
+            if count > start:
+                merged.sections.setdefault(entry_type, []).extend(refs[start:count])
+                done[entry_type] = count
+
+    for name, nb_labels, counts in data.inputs:
+        add_entries(nb_labels, counts)
+        _merge_aux(os.path.normpath(os.path.join(base_dir, name)),
+                   loaded, base_dir, merged, ancestors)
+    add_entries(len(labels), None)
+    ancestors.discard(path)
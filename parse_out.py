@@ -3,29 +3,41 @@
 
 import re
 
+out_re = re.compile(r'\\BOOKMARK\s+\[\d\]\[-\]\{([^}]*)\}\{([^}]*)\}\{([^}]*)\}%\s*(\d+)')
+octal_re = re.compile(r'\\([0-7]{3})')
+
+
 def decode_utf16_bookmark(raw_text):
     # Convert a LaTeX \376\377\0001\000.\000\040\... string to bytes
-    byte_string = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), raw_text)
-    utf16_bytes = byte_string.encode('latin1') 
+    byte_string = octal_re.sub(lambda m: chr(int(m.group(1), 8)), raw_text)
+    utf16_bytes = byte_string.encode('latin1')
     return utf16_bytes.decode('utf-16')
 
-def parse_out_file(path):
 
-    out_pattern = r'\\BOOKMARK\s+\[\d\]\[-\]\{([^}]*)\}\{([^}]*)\}\{([^}]*)\}%\s*(\d+)'
-    out_re = re.compile(out_pattern)
-    out_data = []
+def iter_out_entries(path, entry_types=None):
+    '''
+    Yields the bookmarks of a .out file as (type, ref, raw title, num) tuples,
+    only those of the given types if entry_types is given.
+    The raw titles are not decoded, see bookmark_title.
+    '''
     with open(path, 'r', encoding='utf-8') as f:
         for line in f:
             match = out_re.search(line)
             if match:
                 ref, raw_title, parent, num = match.groups()
-                ref_parts = ref.split(".", 1)
-                title = decode_utf16_bookmark(raw_title)
-                title = remove_prefix(ref_parts[1], title)
-                item = [ref_parts[0], ref_parts[1], title, num]
-                out_data.append(item)
-                
-    return out_data
+                entry_type, _, ref = ref.partition(".")
+                if entry_types is None or entry_type in entry_types:
+                    yield (entry_type, ref, raw_title, num)
+
+
+def bookmark_title(ref, raw_title):
+    '''Displayed title of a bookmark, without its number'''
+    return remove_prefix(ref, decode_utf16_bookmark(raw_title))
+
+
+def parse_out_file(path):
+    return [[entry_type, ref, bookmark_title(ref, raw_title), num]
+            for entry_type, ref, raw_title, num in iter_out_entries(path)]
 
 
 def remove_prefix(begin, string):
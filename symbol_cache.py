@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+# Bump when the format (or the meaning) of the stored data changes
+cache_version = 2
+# Entries unused for this long are removed
+max_age = 30 * 24 * 3600
+# Maximal size of the cache directory (bytes), the oldest entries are removed first
+max_size = 50 * 1024 * 1024
+
+
+class SymbolCache:
+    '''
+    Persistent cache of the data extracted from each LaTeX file (symbols,
+    comment blocks, environment pairs). There is one JSON file per source file,
+    validated by the source file's mtime and size, or by its content hash.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.touched = set()
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.prune()
+
+    def get(self, path, mtime, size):
+        '''The entry for path if the file has not changed, None otherwise'''
+        entry = self._load(path)
+        if entry is None or entry["mtime"] != mtime or entry["size"] != size:
+            return None
+        self._touch(path)
+        return entry
+
+    def get_by_hash(self, path, mtime, size, digest):
+        '''
+        The entry for path if the content of the file has not changed
+        (e.g. the file was only touched), None otherwise
+        '''
+        entry = self._load(path)
+        if entry is None or entry["hash"] != digest:
+            return None
+        entry["mtime"] = mtime
+        entry["size"] = size
+        self._save(path, entry)
+        return entry
+
+    def put(self, path, mtime, size, digest, **data):
+        '''Stores a new entry for path, replacing the previous one'''
+        entry = {"version": cache_version, "path": path,
+                 "mtime": mtime, "size": size, "hash": digest}
+        entry.update(data)
+        self._save(path, entry)
+        return entry
+
+    def update(self, path, mtime, size, **data):
+        '''Adds data to the entry of path, if it is still valid'''
+        entry = self.get(path, mtime, size)
+        if entry is not None:
+            entry.update(data)
+            self._save(path, entry)
+
+    def prune(self):
+        '''Removes the entries that are too old, then the oldest ones if too large'''
+        now = time.time()
+        files = []
+        for name in os.listdir(self.cache_dir):
+            file = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+            if now - st.st_mtime > max_age:
+                self._remove(file)
+            else:
+                files.append((st.st_mtime, st.st_size, file))
+        total = sum(f[1] for f in files)
+        for mtime, size, file in sorted(files):
+            if total <= max_size:
+                break
+            self._remove(file)
+            total -= size
+
+    # ------
+
+    def _entry_file(self, path):
+        name = hashlib.sha1(path.encode("utf-8")).hexdigest() + ".json"
+        return os.path.join(self.cache_dir, name)
+
+    def _load(self, path):
+        with self.lock:
+            if path in self.entries:
+                return self.entries[path]
+        try:
+            with open(self._entry_file(path), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if (entry is not None
+                and (entry.get("version") != cache_version or entry.get("path") != path)):
+            entry = None
+        with self.lock:
+            self.entries[path] = entry
+        return entry
+
+    def _save(self, path, entry):
+        with self.lock:
+            self.entries[path] = entry
+            self.touched.add(path)
+        file = self._entry_file(path)
+        tmp_file = file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_file, file)
+        except OSError:
+            pass
+
+    def _touch(self, path):
+        '''Marks the entry as recently used (once per session)'''
+        with self.lock:
+            if path in self.touched:
+                return
+            self.touched.add(path)
+        try:
+            os.utime(self._entry_file(path))
+        except OSError:
+            pass
+
+    def _remove(self, file):
+        try:
+            os.remove(file)
+        except OSError:
+            pass
+
+# ------------------------------
+
+
+symbol_cache = None
+
+
+def set_cache_dir(cache_dir):
+    '''Enables the symbol cache, stored in cache_dir'''
+    global symbol_cache
+    try:
+        symbol_cache = SymbolCache(cache_dir) if cache_dir else None
+    except OSError:
+        symbol_cache = None
+
+
+def get_symbol_cache():
+    '''The symbol cache, or None when it is disabled'''
+    return symbol_cache
+
+# ------------------------------
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the shifting of the symbols after live edits (no Sublime Text needed).
+
+    python3 -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import importlib
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(package_dir))
+
+package = os.path.basename(package_dir)
+lo_engine = importlib.import_module(package + ".lo_engine")
+outline_model = importlib.import_module(package + ".outline_model")
+
+path = "/tmp/live_edits.tex"
+
+
+def symbols_of(text):
+    return [outline_model.Symbol(sym["region"], sym["type"], sym["content"],
+                                 path, sym["level"])
+            for sym in lo_engine.extract_symbols_from_content(text, path)]
+
+
+class ShiftRegionsTest(unittest.TestCase):
+
+    def test_delete_block_containing_section(self):
+        text = ("\\section{A}\n" + "a" * 100 + "\n\\section{B}\n" + "bb\n" * 70
+                + "\n\\section{C}\n" + "c" * 50 + "\n")
+        symbols = symbols_of(text)
+        a = text.index("a" * 100) + 50
+        b = a + 200
+        new_text = text[:a] + text[b:]
+
+        dirty = outline_model.shift_regions(symbols, [(a, b, 0)])
+
+        # B is in the range scanned again, where it is no more found
+        sym_b = next(sym for sym in symbols if sym.content == "B")
+        self.assertLessEqual(sym_b.start, sym_b.end)
+        self.assertTrue(any(ds <= sym_b.start <= de for ds, de in dirty))
+        for ds, de in dirty:
+            self.assertNotIn("\\section{B}", new_text[ds:de])
+        # The others are at their new place
+        expected = {sym.content: sym.region for sym in symbols_of(new_text)}
+        self.assertEqual(expected, {"A": symbols[0].region, "C": symbols[2].region})
+
+    def test_pending_edits_dropped_after_full_scan(self):
+        text = "\\section{A}\ntext\n\\section{B}\n"
+        new_text = "x" * 500 + text
+        live_edits = outline_model.LiveEdits()
+        live_edits.add(1, [(0, 0, 500)])
+
+        # A save scans the buffer again before the edits are applied
+        symbols = symbols_of(new_text)
+        live_edits.discard([1])
+        outline_model.shift_regions(symbols, live_edits.take(1))
+
+        self.assertEqual([sym.region for sym in symbols],
+                         [sym.region for sym in symbols_of(new_text)])
+        self.assertEqual([sym.start for sym in symbols], [500, 517])
+
+    def test_many_edits_in_order(self):
+        text = "".join("\\section{S%d}\nsome text\n" % i for i in range(200))
+        symbols = symbols_of(text)
+        # Replace every "some" by "any", as a replace-all does
+        edits = []
+        new_text = text
+        pos = new_text.find("some")
+        while pos != -1:
+            edits.append((pos, pos + 4, 3))
+            new_text = new_text[:pos] + "any" + new_text[pos + 4:]
+            pos = new_text.find("some", pos)
+        outline_model.shift_regions(symbols, edits)
+        self.assertEqual([sym.region for sym in symbols],
+                         [sym.region for sym in symbols_of(new_text)])
+
+    def test_insert_before_symbols(self):
+        text = "\\section{A}\ntext\n\\section{B}\n"
+        symbols = symbols_of(text)
+        dirty = outline_model.shift_regions(symbols, [(0, 0, 3)])
+        self.assertEqual([sym.region for sym in symbols_of("xyz" + text)],
+                         [sym.region for sym in symbols])
+        self.assertEqual(dirty, [[0, 3]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import re
+from bisect import bisect_right
+from functools import lru_cache
+
+# ------------- Some regex patterns ----------------
+
+comment_line_re = re.compile(r"^[^\S\n]*%", re.MULTILINE)
+comment_pkg_re = re.compile(r"\\usepackage(?:\[[^\]]*\])?{[^}]*\bcomment\b[^}]*}")
+comment_begin_tag = r"\begin{comment}"
+comment_end_tag = r"\end{comment}"
+# Escaped characters and comments: the scanners match them first, so that
+# the commands they contain are consumed with them, and skipped
+comment_or_escape_pattern = r"\\[\\%]|%[^\n]*"
+
+# -------------------------------------------------
+
+
+class TextIndex:
+    '''
+    The `comment` environments of a text, and whether it loads the comment
+    package. Built once per content, so that position queries are done by
+    bisection.
+    '''
+
+    def __init__(self, text):
+        self.uses_comment_package = any(
+            not _in_commented_line(text, m.start()) for m in comment_pkg_re.finditer(text))
+        self.comment_blocks = _find_comment_blocks(text)
+
+    def in_comment_block(self, pos):
+        '''Whether the given position is inside a `comment` environment'''
+        return in_comment_block(self.comment_blocks, pos)
+
+# ------------------------------
+
+
+@lru_cache(maxsize=64)
+def get_text_index(text):
+    '''The (cached) index of the given text'''
+    return TextIndex(text)
+
+# ------------------------------
+
+
+def in_comment_block(blocks, pos):
+    '''Whether pos is inside one of the sorted, disjoint (start, end) blocks'''
+    i = bisect_right(blocks, (pos, float('inf'))) - 1
+    return i >= 0 and pos < blocks[i][1]
+
+# ------------------------------
+
+
+def _in_commented_line(text, pos):
+    '''Whether the line of the given position starts with a %'''
+    return comment_line_re.match(text, text.rfind("\n", 0, pos) + 1) is not None
+
+# ------------------------------
+
+
+def _find_comment_blocks(text):
+    '''Sorted top-level \\begin{comment}...\\end{comment} intervals'''
+    stack = []
+    top_level_blocks = []
+
+    index = 0
+    while index < len(text):
+        next_start = text.find(comment_begin_tag, index)
+        next_end = text.find(comment_end_tag, index)
+
+        if next_start != -1 and (next_start < next_end or next_end == -1):
+            stack.append(next_start)
+            index = next_start + len(comment_begin_tag)
+        elif next_end != -1:
+            if not stack:
+                # Unmatched \\end{comment}
+                break
+            start_pos = stack.pop()
+            if not stack:
+                top_level_blocks.append((start_pos, next_end + len(comment_end_tag)))
+            index = next_end + len(comment_end_tag)
+        else:
+            break
+
+    return top_level_blocks